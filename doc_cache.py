@@ -0,0 +1,64 @@
+import hashlib
+import os
+import shutil
+
+CACHE_ROOT = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "PdfTranslator")
+CACHE_SIZE_LIMIT = 512 * 1024 * 1024  # bytes in the directories of all documents
+
+
+def document_hash(filename: str) -> str:
+    """ Content hash of the file, cache entries of a document survive renames and moves """
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def document_cache_dir(doc_hash: str, *sub_dirs: str) -> str:
+    """ Returns the cache directory of a document, it is created if missing """
+    path = os.path.join(CACHE_ROOT, doc_hash, *sub_dirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def directory_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:  # removed meanwhile
+                pass
+    return size
+
+
+def evict_documents(doc_hash: str):
+    """ Marks the directory of the opened document as used, then removes the least recently used
+        directories of other documents until the cache fits CACHE_SIZE_LIMIT. Every rewrite of a
+        watched file has a new hash, directories of its previous versions are evicted first """
+    os.utime(document_cache_dir(doc_hash))
+    entries = []
+    for name in os.listdir(CACHE_ROOT):
+        path = os.path.join(CACHE_ROOT, name)
+        if name != doc_hash and os.path.isdir(path):
+            entries.append((os.path.getmtime(path), directory_size(path), path))
+    total = directory_size(os.path.join(CACHE_ROOT, doc_hash)) + sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= CACHE_SIZE_LIMIT:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def page_hash(page) -> str:
+    """ Hash of what is drawn on a pymupdf page: its size, its content stream, the form xobjects it
+        uses and the size and format of its images. It tells which pages changed after a file is rewritten """
+    sha1 = hashlib.sha1(str(tuple(page.rect)).encode())
+    sha1.update(page.read_contents())
+    for xref, name, _, _ in page.get_xobjects():
+        sha1.update(name.encode())
+        sha1.update(page.parent.xref_stream(xref) or b"")
+    for image in page.get_images(full=True):
+        sha1.update(str(image[2:8]).encode())
+    return sha1.hexdigest()
@@ -0,0 +1,90 @@
+from array import array
+from typing import Dict, List
+
+from PyQt5 import QtCore
+
+PAGE_ROLE = QtCore.Qt.UserRole + 1
+TOP_ROLE = QtCore.Qt.UserRole + 2
+
+
+class OutlineModel(QtCore.QAbstractItemModel):
+    """ Outline tree over the flat list returned by get_toc, entries are [level, title, page].
+        Parent, row and subtree end of every entry are computed in one pass, the children of
+        an entry are listed only when the view asks for them, that is when it is expanded.
+        The internal id of an index is the position of its entry in the list """
+
+    def __init__(self, toc: List[list], parent=None):
+        QtCore.QAbstractItemModel.__init__(self, parent)
+        self.toc = toc
+        count = len(toc)
+        self.parents = array("i", [-1]) * count
+        self.rows = array("i", [0]) * count
+        self.ends = array("i", [count]) * count  # entries of a subtree are in [entry, end)
+        child_counts = {}
+        open_entries = []
+        for entry, item in enumerate(toc):
+            while open_entries and toc[open_entries[-1]][0] >= item[0]:
+                self.ends[open_entries.pop()] = entry
+            parent_entry = open_entries[-1] if open_entries else -1
+            self.parents[entry] = parent_entry
+            self.rows[entry] = child_counts.get(parent_entry, 0)
+            child_counts[parent_entry] = self.rows[entry] + 1
+            open_entries.append(entry)
+        self.children: Dict[int, List[int]] = {}  # entry: child entries, -1 for the top level
+
+    def child_entries(self, entry) -> List[int]:
+        if entry not in self.children:
+            children = []
+            child = entry + 1
+            end = self.ends[entry] if entry != -1 else len(self.toc)
+            while child < end:
+                children.append(child)
+                child = self.ends[child]
+            self.children[entry] = children
+        return self.children[entry]
+
+    def entry_of(self, index) -> int:
+        return index.internalId() if index.isValid() else -1
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        children = self.child_entries(self.entry_of(parent))
+        if not 0 <= row < len(children) or not 0 <= column < 2:
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        parent_entry = self.parents[index.internalId()]
+        if parent_entry == -1:
+            return QtCore.QModelIndex()
+        return self.createIndex(self.rows[parent_entry], 0, parent_entry)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.child_entries(self.entry_of(parent)))
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 2
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        # answered from the subtree end, collapsed entries never list their children
+        entry = self.entry_of(parent)
+        if entry == -1:
+            return len(self.toc) > 0
+        return parent.column() == 0 and self.ends[entry] > entry + 1
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        level, title, page_number = self.toc[index.internalId()][:3]
+        if role == QtCore.Qt.DisplayRole:
+            return title if index.column() == 0 else str(page_number)
+        if role == QtCore.Qt.TextAlignmentRole and index.column() == 1:
+            return QtCore.Qt.AlignRight
+        if role == PAGE_ROLE:
+            return page_number
+        if role == TOP_ROLE:
+            return 0
+        return None
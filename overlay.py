@@ -0,0 +1,53 @@
+from typing import List, Tuple
+
+from PyQt5 import QtCore
+from PyQt5.QtGui import QImage, QPainter, QColor, QFont, QFontMetricsF
+
+OVERLAY_FONT_FAMILY = "times"
+OVERLAY_BACKGROUND = QColor(255, 255, 250)
+OVERLAY_TEXT_COLOR = QColor(0, 0, 90)
+# font sizes in pixels tried for a block, the smallest one is used even if the text does not fit
+OVERLAY_MIN_PIXEL_SIZE = 5
+OVERLAY_MAX_PIXEL_SIZE = 60
+TEXT_FLAGS = QtCore.Qt.TextWordWrap | QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop
+
+BLOCK = Tuple[Tuple[float, float, float, float], str]  # block rect in points, translated text
+
+
+def fit_pixel_size(text: str, width: float, height: float) -> int:
+    """ Largest font size at which the wrapped text fits into the box, found by bisection """
+    font = QFont(OVERLAY_FONT_FAMILY)
+    low, high = OVERLAY_MIN_PIXEL_SIZE, OVERLAY_MAX_PIXEL_SIZE
+    while low < high:
+        size = (low + high + 1) // 2
+        font.setPixelSize(size)
+        bounds = QFontMetricsF(font).boundingRect(QtCore.QRectF(0, 0, width, 1e6), TEXT_FLAGS, text)
+        if bounds.height() <= height and bounds.width() <= width:
+            low = size
+        else:
+            high = size - 1
+    return low
+
+
+def compose_overlay(image: QImage, dpi: float, blocks: List[BLOCK]) -> QImage:
+    """ Copy of the page image with each text block covered by its translation.
+        It paints on a QImage, so it may run in a worker thread """
+    if image.format() in (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_RGB888):
+        result = image.copy()
+    else:  # grayscale pages are painted in color
+        result = image.convertToFormat(QImage.Format_RGB32)
+    zoom = dpi / 72.0
+    painter = QPainter(result)
+    painter.setRenderHint(QPainter.TextAntialiasing)
+    font = QFont(OVERLAY_FONT_FAMILY)
+    for (x0, y0, x1, y1), text in blocks:
+        box = QtCore.QRectF(x0 * zoom, y0 * zoom, (x1 - x0) * zoom, (y1 - y0) * zoom)
+        if not text or box.isEmpty():
+            continue
+        painter.fillRect(box, OVERLAY_BACKGROUND)
+        font.setPixelSize(fit_pixel_size(text, box.width(), box.height()))
+        painter.setFont(font)
+        painter.setPen(OVERLAY_TEXT_COLOR)
+        painter.drawText(box, TEXT_FLAGS, text)
+    painter.end()
+    return result
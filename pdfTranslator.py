@@ -1,36 +1,79 @@
-from typing import List
+from collections import OrderedDict
+from typing import List, Optional
+import bisect
+import math
 import os
 import re
+import sqlite3
 import sys
+import time
 
 import PyQt5
 import pymupdf
 from PyQt5 import QtCore
-from PyQt5.QtGui import (QFont, QKeySequence, QPainter, QColor, QPixmap, QImage, QIcon,
-                         QStandardItem, QFontInfo,
-                         QIntValidator, QStandardItemModel, QCursor, QCloseEvent
+from PyQt5.QtGui import (QFont, QKeySequence, QPainter, QColor, QImage, QIcon,
+                         QFontInfo,
+                         QIntValidator, QCursor, QCloseEvent, QRegion
                          )
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QShortcut, QWidget, QFrame, QVBoxLayout, QLabel,
-    QFileDialog, QAction, QLineEdit,
-    QComboBox)
+    QFileDialog, QAction, QActionGroup, QLineEdit, QMenu, QToolButton,
+    QComboBox, QDockWidget, QListView)
 
 from ui_mainwindow import Ui_window
 
 TRANSLATE_ACTIVE = True
+# render pages in worker processes instead of the renderer threads
+RENDER_IN_PROCESSES = True
+COLOR_MODE_NAMES = {"color": "Color", "gray": "Grayscale", "auto": "Grayscale Text Pages"}
 
-if TRANSLATE_ACTIVE:
-    from translator_helper import translate, translate_word
+# render pool workers import this module again as __mp_main__, they don't need the translation models
+if TRANSLATE_ACTIVE and __name__ != "__mp_main__":
+    from translator_helper import translate, translate_word, translate_batch, MODEL_NAME
 else:
+    MODEL_NAME = "none"
+
     def translate(sample_text: str) -> str:
         return sample_text
 
     def translate_word(word: str) -> str:
         return word
 
+    def translate_batch(texts: List[str]) -> List[str]:
+        return list(texts)
+
 from x_y_cut import XYcut, WORD
+from text_model import PageText
+from render_pool import RenderPool
+from render_cache import DisplayListCache, CompressedImageCache, COLOR_MODES, qimage_format
+from doc_cache import document_hash, evict_documents, page_hash
+from thumbnails import ThumbnailRenderer, ThumbnailModel, ThumbnailView, THUMBNAIL_WIDTH
+from reflow import ReflowModel, ReflowView
+from overlay import compose_overlay
+from translation_store import TranslationStore, BLOCK, SELECTION, SENTENCE, block_offsets
+from pretranslate import Pretranslator, PRETRANSLATE_IDLE_SEC
+from outline import OutlineModel, PAGE_ROLE, TOP_ROLE
+from search_index import SearchIndexer, Searcher, SearchResultsModel
     
 SCREEN_DPI = 100
+# while scrolling faster than this, pages are rendered as drafts
+FAST_SCROLL_PAGES_PER_SEC = 2.5
+DRAFT_DPI_SCALE = 0.5
+# pages resized per event loop iteration after a resize or zoom change
+RESIZE_BATCH = 100
+# waits for the file to be completely written before it is reloaded
+RELOAD_DELAY_MS = 500
+# a hovered word is translated when the pointer stays on it this long
+HOVER_DWELL_MS = 120
+# a search starts when typing pauses this long
+SEARCH_DELAY_MS = 300
+# block translations kept in memory, the translation store keeps all of them
+BLOCK_TRANSLATIONS_LIMIT = 2000
+# page sizes sent by the document loader at a time
+GEOMETRY_CHUNK = 200
+# pages rendered ahead of the screen in scroll direction
+PREFETCH_MIN = 2
+PREFETCH_MAX = 12
 sys.path.append(os.path.dirname(__file__))  # for enabling python 2 like import
 HOMEDIR = os.path.expanduser("~")
 DEBUG = False
@@ -61,88 +104,256 @@ class Worker(QtCore.QRunnable):
 
 class Translator(QtCore.QObject):
     selectionTranslateReady = QtCore.pyqtSignal()
+    blocksTranslated = QtCore.pyqtSignal(int, list, list)
 
     def __init__(self, win):
         QtCore.QObject.__init__(self)
 
         self.win = win
 
-        self.already_translated = {}
+        self.already_translated = {}  # page_no: {word: translation}
+        # block text: translation, shared by the reflow view and the overlay, oldest first
+        self.block_translations = OrderedDict()
+        # translations of earlier sessions, read before the model is used
+        self.store: Optional[TranslationStore] = None
+        # set by the main window, pages scrolled away are not translated
+        self.is_page_wanted = None
+
+    def load_document(self, filename, password='', doc_hash=''):
+        self.block_translations.clear()
+        # the store of the previous document is closed when it is not referenced anymore
+        try:
+            self.store = TranslationStore.open_document(doc_hash)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Can not open the translation store of {filename}: {e}")
+            self.store = None
 
     def translate_word(self, page_no: int, word: str):
         word = word.lower()
-        # if word in self.already_translated.keys():
-        #     return self.already_translated[word]
-
+        page_translations = self.already_translated.setdefault(page_no, {})
+        if word in page_translations:
+            return page_translations[word]
+
+        store = self.store
+        word_translated = store.get_word(MODEL_NAME, word) if store is not None else None
+        if word_translated is not None:
+            page_translations[word] = word_translated
+            return word_translated
         word_translated = translate_word(word)
+        if store is not None:
+            store.put_word(MODEL_NAME, word, word_translated)
 
         #word_translated = re.sub('[\"\'\“\”.,:;?()\[\]\{\}]', '', word_translated)
 
-        #self.already_translated[word] = word_translated
+        page_translations[word] = word_translated
         return word_translated
 
-    def translate_selection(self, text):
-        self.win.selection_translated = translate(text)
+    def forget_page(self, page_no: int):
+        # translations are kept per page, so they survive reloads of documents whose other pages changed
+        self.already_translated.pop(page_no, None)
+
+    def translate_selection(self, text, key=None, sentences=None):
+        """ key is (page_no, offset of the first word), a stored translation of the same text is reused.
+        sentences are (offset, text) of the sentences holding the selection, when the selection is
+        exactly these sentences and all of them were translated in the background their translations are shown """
+        store = self.store if key is not None else None
+        translated = None
+        if store is not None:
+            translated = store.get_texts(MODEL_NAME, SELECTION, key[0], [(key[1], text)]).get(key[1])
+        if sentences and text.split() != " ".join(source for _, source in sentences).split():
+            sentences = None  # part of a sentence is selected, the model translates the selection itself
+        if translated is None and store is not None and sentences:
+            stored = store.get_texts(MODEL_NAME, SENTENCE, key[0], sentences)
+            if len(stored) == len(sentences):
+                translated = " ".join(stored[start] for start, _ in sentences)
+        if translated is None:
+            translated = translate(text)
+            if store is not None:
+                store.put_texts(MODEL_NAME, SELECTION, key[0], [(key[1], text, translated)])
+        self.win.selection_translated = translated
         self.selectionTranslateReady.emit()
 
+    def translate_blocks(self, page_no, blocks):
+        """ translateBlocks(int, list)
+        Translates text blocks of a page for the reflow view and the overlay, the blocks
+        that were not translated before are sent to the model in one batch """
+        if self.is_page_wanted is not None and not self.is_page_wanted(page_no):
+            self.blocksTranslated.emit(page_no, blocks, [])
+            return
+        store = self.store
+        items = [(offset, block) for offset, block in zip(block_offsets(blocks), blocks)
+                 if block not in self.block_translations]
+        if store is not None and items:
+            stored = store.get_texts(MODEL_NAME, BLOCK, page_no, items)
+            self.block_translations.update((block, stored[offset]) for offset, block in items if offset in stored)
+        items = [(offset, block) for offset, block in items if block not in self.block_translations]
+        missing = list(dict.fromkeys(block for _, block in items))
+        if missing:
+            self.block_translations.update(zip(missing, translate_batch(missing)))
+        if store is not None and items:
+            store.put_texts(MODEL_NAME, BLOCK, page_no,
+                            [(offset, block, self.block_translations[block]) for offset, block in items])
+        self.blocksTranslated.emit(page_no, blocks, [self.block_translations[block] for block in blocks])
+        while len(self.block_translations) > BLOCK_TRANSLATIONS_LIMIT:
+            self.block_translations.popitem(last=False)
+
 class Renderer(QtCore.QObject):
-    rendered = QtCore.pyqtSignal(int, QImage)
-    textFound = QtCore.pyqtSignal(int, list)
+    rendered = QtCore.pyqtSignal(int, float, QImage, bool)
 
-    def __init__(self, page_set=1):
+    def __init__(self, page_set=1, color_mode="color"):
         # page_set = 1 for odd, and 0 for even
         QtCore.QObject.__init__(self)
         self.doc = None
+        self.display_lists = None
         self.page_set = page_set
+        self.color_mode = color_mode
+        # set by the main window, tells whether a queued request is still needed after a zoom change
+        self.is_wanted = None
         self.painter = QPainter()
         self.link_color = QColor(0, 0, 127, 40)
 
-    def render(self, page_no, dpi):
-        """ render(int, float)
+    def render(self, page_no, dpi, draft=False):
+        """ render(int, float, bool)
         This slot takes page no. and dpi and renders that page, then emits a signal with QImage"""
         # Returns when both is true or both is false
         if page_no % 2 != self.page_set:
             return
-        page = self.doc[page_no - 1]
-        if not page:
+        if self.is_wanted is not None and not self.is_wanted(page_no, dpi):
             return
-        img: pymupdf.Pixmap = page.get_pixmap(dpi=int(dpi))
+        if self.display_lists is None:
+            return
+        img: pymupdf.Pixmap = self.display_lists.render(page_no, dpi, draft)
         pix = img.samples
         stride = img.stride
-        n_channels = 4 if img.alpha else 3
-
-        # QImage formatını belirle
-        if n_channels == 4:
-            img_format = QImage.Format.Format_RGBA8888
-        else:
-            img_format = QImage.Format.Format_RGB888
-        qimg = QImage(pix, img.width, img.height, stride, img_format)
+        # copy() makes the image own its pixels, the pixmap samples are freed when this method returns
+        qimg = QImage(pix, img.width, img.height, stride, qimage_format(img.n)).copy()
 
-        self.rendered.emit(page_no, qimg)
+        self.rendered.emit(page_no, dpi, qimg, draft)
 
-    def load_document(self, filename, password=''):
+    def load_document(self, filename, password='', doc_hash=''):
         """ loadDocument(str)
         Main thread uses this slot to load document for rendering """
-        self.doc = pymupdf.open(filename=filename)
+        self.close_document()
+        try:
+            self.doc = pymupdf.open(filename=filename)
+        except Exception as e:
+            # the file may be rewritten meanwhile, the reload after the next change opens it again
+            print(f"Renderer can not open {filename}: {e}")
+            return
+        self.display_lists = DisplayListCache(self.doc, self.color_mode)
+
+    def set_color_mode(self, color_mode):
+        """ setColorMode(str)
+        Requests queued from now on are rendered in the new mode """
+        self.color_mode = color_mode
+        if self.display_lists is not None:
+            self.display_lists.color_mode = color_mode
+
+    def close_document(self):
+        """ closeDocument()
+        The file is being rewritten, requests are skipped until the next load_document """
+        self.display_lists = None
+        if self.doc is not None:
+            self.doc.close()
+        self.doc = None
 
-    def find_text(self, text, page_no, find_reverse):
-        if find_reverse:
-            pages = [i for i in range(1, page_no + 1)]
-            pages.reverse()
-        else:
-            pages = [i for i in range(page_no, len(self.doc) + 1)]
-        for working_page in pages:
-            page: pymupdf.Page = self.doc[working_page - 1]
-            text_areas = page.search_for(text, quads=True)
-            if text_areas != []:
-                self.textFound.emit(working_page, text_areas)
-                break
+
+class DocumentLoader(QtCore.QObject):
+    """ Opens documents in the background. Page sizes are sent in chunks as they are read, the outline
+        follows them, then the document is handed to the main thread and is not used here anymore """
+    # generation, filename, content hash, page count, first page size
+    opened = QtCore.pyqtSignal(int, str, str, int, float, float)
+    geometryReady = QtCore.pyqtSignal(int, int, list)  # generation, first page no, page sizes
+    outlineReady = QtCore.pyqtSignal(int, list)
+    loaded = QtCore.pyqtSignal(int, object)
+    # generation, document, content hash, page sizes, changed page nos
+    reloaded = QtCore.pyqtSignal(int, object, str, list, list)
+    failed = QtCore.pyqtSignal(int, str, str)
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        # set from the main thread, loading stops when a newer document is requested
+        self.generation = 0
+        self.page_hashes = []  # content hash of each page of the loaded document
+        self.doc_hash = ''
+
+    def load(self, generation, filename):
+        try:
+            # hashed once here, the workers get the hash with the load signal to find the cache of the document
+            doc_hash = document_hash(filename)
+            doc = pymupdf.open(filename)
+            if doc.page_count == 0:
+                raise ValueError("document has no pages")
+        except Exception as e:
+            self.failed.emit(generation, filename, str(e))
+            return
+        self.page_hashes = []
+        self.doc_hash = doc_hash
+        first_rect = doc[0].rect
+        self.opened.emit(generation, filename, doc_hash, doc.page_count, first_rect.width, first_rect.height)
+        for first_page in range(0, doc.page_count, GEOMETRY_CHUNK):
+            if generation != self.generation:
+                return
+            pages = [doc[i] for i in range(first_page, min(first_page + GEOMETRY_CHUNK, doc.page_count))]
+            self.page_hashes += [page_hash(page) for page in pages]
+            self.geometryReady.emit(generation, first_page + 1, [(page.rect.width, page.rect.height) for page in pages])
+        if generation != self.generation:
+            return
+        self.outlineReady.emit(generation, doc.get_toc())
+        self.loaded.emit(generation, doc)
+        self.evict_cache(doc_hash)
+
+    def reload(self, generation, filename):
+        """ Opens the rewritten file of the loaded document and compares page hashes
+            with the previous version. Pages are compared by their position """
+        try:
+            doc_hash = document_hash(filename)
+            doc = pymupdf.open(filename)
+            if doc.page_count == 0:
+                raise ValueError("document has no pages")
+            page_hashes = [page_hash(page) for page in doc]
+        except Exception as e:
+            # the file may be read while it is still being written, a later change event retries
+            self.failed.emit(generation, filename, str(e))
+            return
+        if generation != self.generation:
+            doc.close()
+            return
+        changed = [i + 1 for i, new_hash in enumerate(page_hashes)
+                   if i >= len(self.page_hashes) or self.page_hashes[i] != new_hash]
+        self.page_hashes = page_hashes
+        if doc_hash != self.doc_hash:
+            # translations of unchanged text are reused, the workers open the new store after the reload
+            try:
+                TranslationStore.copy_document(self.doc_hash, doc_hash)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Can not copy the translations of {filename}: {e}")
+            self.doc_hash = doc_hash
+        sizes = [(page.rect.width, page.rect.height) for page in doc]
+        self.outlineReady.emit(generation, doc.get_toc())
+        self.reloaded.emit(generation, doc, doc_hash, sizes, changed)
+        self.evict_cache(doc_hash)
+
+    def evict_cache(self, doc_hash):
+        try:
+            evict_documents(doc_hash)
+        except OSError as e:
+            print(f"Can not evict the document cache: {e}")
 
 
 class Window(QMainWindow, Ui_window):
-    renderRequested = QtCore.pyqtSignal(int, float)
-    loadFileRequested = QtCore.pyqtSignal(str, str)
-    findTextRequested = QtCore.pyqtSignal(str, int, bool)
+    renderRequested = QtCore.pyqtSignal(int, float, bool)
+    loadFileRequested = QtCore.pyqtSignal(str, str, str)  # filename, password, content hash
+    closeFileRequested = QtCore.pyqtSignal()
+    colorModeRequested = QtCore.pyqtSignal(str)
+    thumbnailBatchRequested = QtCore.pyqtSignal(int, list, int)
+    openDocumentRequested = QtCore.pyqtSignal(int, str)
+    reloadDocumentRequested = QtCore.pyqtSignal(int, str)
+    indexDocumentRequested = QtCore.pyqtSignal(int, str, str)
+    searchRequested = QtCore.pyqtSignal(int, str, int)
+    blocksTranslationRequested = QtCore.pyqtSignal(int, list)
+    overlayReady = QtCore.pyqtSignal(int, float, QImage)
+    pretranslateRequested = QtCore.pyqtSignal(int)
     
     def __init__(self, parent=None):
         QMainWindow.__init__(self, parent)
@@ -153,10 +364,26 @@ class Window(QMainWindow, Ui_window):
         self.findTextEdit.setFocusPolicy(QtCore.Qt.StrongFocus)
         self.treeView.setAlternatingRowColors(True)
         self.treeView.clicked.connect(self.on_outline_click)
+        self.treeView.setMouseTracking(True)
+        self.treeView.entered.connect(self.on_outline_hover)
         # resizing pages requires some time to take effect
         self.resizePageTimer = QtCore.QTimer(self)
         self.resizePageTimer.setSingleShot(True)
         self.resizePageTimer.timeout.connect(self.on_window_resize)
+        # renders pages in full quality when fast scrolling stops
+        self.scrollSettleTimer = QtCore.QTimer(self)
+        self.scrollSettleTimer.setSingleShot(True)
+        self.scrollSettleTimer.timeout.connect(self.on_scroll_settle)
+        # reloads the document when the file is rewritten, e.g. by a LaTeX build
+        self.fileWatcher = QtCore.QFileSystemWatcher(self)
+        self.fileWatcher.fileChanged.connect(self.on_file_changed)
+        self.reloadTimer = QtCore.QTimer(self)
+        self.reloadTimer.setSingleShot(True)
+        self.reloadTimer.timeout.connect(self.reload_pdf)
+        # words crossed by the pointer on its way are not translated
+        self.hoverTimer = QtCore.QTimer(self)
+        self.hoverTimer.setSingleShot(True)
+        self.hoverTimer.timeout.connect(self.on_hover_dwell)
         # Add shortcut actions
         self.findTextAction = QAction(QIcon(":/search.png"), "Find Text", self)
         self.findTextAction.setShortcut('Ctrl+F')
@@ -165,6 +392,61 @@ class Window(QMainWindow, Ui_window):
         self.outline = QAction(QIcon(":/outline.png"), "Outline", self)
         self.outline.setShortcut('Ctrl+T')
         self.outline.triggered.connect(self.dock_outline_open_hide)
+        self.thumbnailAction = QAction("Thumbnails", self)
+        self.thumbnailAction.setShortcut('Ctrl+B')
+        self.thumbnailAction.triggered.connect(self.dock_thumbnails_open_hide)
+        self.reflowAction = QAction("Reflow", self)
+        self.reflowAction.setShortcut('Ctrl+R')
+        self.reflowAction.triggered.connect(self.reflow_open_hide)
+        self.overlayAction = QAction("Translated Pages", self)
+        self.overlayAction.setShortcut('Ctrl+L')
+        self.overlayAction.triggered.connect(self.overlay_open_hide)
+        self.pretranslateAction = QAction("Translate in Background", self)
+        self.pretranslateAction.setCheckable(True)
+        self.pretranslateAction.triggered.connect(self.pretranslate_on_off)
+        # checked after the color mode is read from the settings
+        self.colorModeAction = QAction("Color Mode", self)
+        self.colorModeGroup = QActionGroup(self)
+        self.colorModeGroup.triggered.connect(self.set_color_mode)
+        color_mode_menu = QMenu(self)
+        for color_mode in COLOR_MODES:
+            action = QAction(COLOR_MODE_NAMES[color_mode], self.colorModeGroup)
+            action.setCheckable(True)
+            action.setData(color_mode)
+            color_mode_menu.addAction(action)
+        self.colorModeAction.setMenu(color_mode_menu)
+        # Reflowed text view, it takes the place of the pages
+        self.reflowView = ReflowView(self.centralwidget)
+        self.verticalLayout_2.addWidget(self.reflowView)
+        self.reflowView.hide()
+        # Thumbnail sidebar
+        self.dockThumbnails = QDockWidget(self)
+        self.dockThumbnails.setFeatures(QDockWidget.NoDockWidgetFeatures)
+        self.dockThumbnails.setWindowTitle("")
+        self.dockThumbnails.setMinimumWidth(THUMBNAIL_WIDTH + 40)
+        self.thumbnailView = ThumbnailView(self.dockThumbnails)
+        self.thumbnailView.pageClicked.connect(self.jump_page)
+        self.thumbnailView.thumbnailsRequested.connect(self.request_thumbnails)
+        self.dockThumbnails.setWidget(self.thumbnailView)
+        self.addDockWidget(QtCore.Qt.LeftDockWidgetArea, self.dockThumbnails)
+        self.dockThumbnails.hide()
+        # Search results, one row per page with hits, and the hit count next to the search box
+        self.searchCountLabel = QLabel(self.dockWidgetContents_2)
+        self.horizontalLayout.addWidget(self.searchCountLabel)
+        self.searchTimer = QtCore.QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.timeout.connect(self.start_search)
+        self.dockSearchResults = QDockWidget(self)
+        self.dockSearchResults.setFeatures(QDockWidget.NoDockWidgetFeatures)
+        self.dockSearchResults.setWindowTitle("")
+        self.searchResultsModel = SearchResultsModel(self)
+        self.searchResultsView = QListView(self.dockSearchResults)
+        self.searchResultsView.setModel(self.searchResultsModel)
+        self.searchResultsView.setUniformItemSizes(True)
+        self.searchResultsView.clicked.connect(self.on_search_result_click)
+        self.dockSearchResults.setWidget(self.searchResultsView)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.dockSearchResults)
+        self.dockSearchResults.hide()
         # connect menu actions signals
         self.openFileAction.triggered.connect(self.open_file)
         self.zoominAction.triggered.connect(self.zoom_in)
@@ -189,6 +471,12 @@ class Window(QMainWindow, Ui_window):
         self.toolBar.addAction(self.openFileAction)
         self.toolBar.addSeparator()
         self.toolBar.addAction(self.outline)
+        self.toolBar.addAction(self.thumbnailAction)
+        self.toolBar.addAction(self.reflowAction)
+        self.toolBar.addAction(self.overlayAction)
+        self.toolBar.addAction(self.pretranslateAction)
+        self.toolBar.addAction(self.colorModeAction)
+        self.toolBar.widgetForAction(self.colorModeAction).setPopupMode(QToolButton.InstantPopup)
         self.toolBar.addSeparator()
         self.toolBar.addAction(self.zoomoutAction)
         self.toolBar.addWidget(self.zoomLevelCombo)
@@ -226,63 +514,161 @@ class Window(QMainWindow, Ui_window):
         self.offset_y = int(self.settings.value("OffsetY", 26))
         self.available_area = [desktop.availableGeometry().width(), desktop.availableGeometry().height()]
         self.zoomLevelCombo.setCurrentIndex(int(self.settings.value("ZoomLevel", 5)))
+        # "gray" or "auto" renders text pages with one byte per pixel
+        self.color_mode = self.settings.value("ColorMode", "color")
+        if self.color_mode not in COLOR_MODES:
+            self.color_mode = "color"
+        for action in self.colorModeGroup.actions():
+            action.setChecked(action.data() == self.color_mode)
         # Connect Signals
         self.scrollArea.verticalScrollBar().valueChanged.connect(self.on_mouse_scroll)
         self.scrollArea.verticalScrollBar().sliderReleased.connect(self.on_slider_release)
         self.findTextEdit.returnPressed.connect(self.find_next)
+        self.findTextEdit.textChanged.connect(self.on_find_text_changed)
         self.findNextButton.clicked.connect(self.find_next)
         self.findBackButton.clicked.connect(self.find_back)
         self.dockSearch.visibilityChanged.connect(self.dock_find_open_hide)
-        # Create separate thread and move renderer to it
-        self.thread1 = QtCore.QThread(self)
-        self.renderer1 = Renderer(0)
-        self.renderer1.moveToThread(self.thread1)  # this must be moved before connecting signals
-        self.renderRequested.connect(self.renderer1.render)
-        self.loadFileRequested.connect(self.renderer1.load_document)
-        self.findTextRequested.connect(self.renderer1.find_text)
-        self.renderer1.rendered.connect(self.set_rendered_image)
-        self.renderer1.textFound.connect(self.on_text_found)
-        self.thread1.start()
-        self.thread2 = QtCore.QThread(self)
-        self.renderer2 = Renderer(1)
-        self.renderer2.moveToThread(self.thread2)
-        self.renderRequested.connect(self.renderer2.render)
-        self.loadFileRequested.connect(self.renderer2.load_document)
-        self.renderer2.rendered.connect(self.set_rendered_image)
-        self.thread2.start()
+        # Pages are rendered either by the process pool or by two renderer threads
+        self.renderPool = None
+        self.thread1 = self.thread2 = None
+        if RENDER_IN_PROCESSES:
+            self.renderPool = RenderPool(self.color_mode)
+            self.renderPool.is_wanted = self.is_render_wanted
+            self.renderRequested.connect(self.renderPool.render)
+            self.loadFileRequested.connect(self.renderPool.load_document)
+            self.closeFileRequested.connect(self.renderPool.close_document)
+            self.colorModeRequested.connect(self.renderPool.set_color_mode)
+            self.renderPool.rendered.connect(self.set_rendered_image)
+        else:
+            # Create separate thread and move renderer to it
+            self.thread1 = QtCore.QThread(self)
+            self.renderer1 = Renderer(0, self.color_mode)
+            self.renderer1.moveToThread(self.thread1)  # this must be moved before connecting signals
+            self.loadFileRequested.connect(self.renderer1.load_document)
+            self.thread1.start()
+            self.thread2 = QtCore.QThread(self)
+            self.renderer2 = Renderer(1, self.color_mode)
+            self.renderer2.moveToThread(self.thread2)
+            self.thread2.start()
+            self.renderer1.is_wanted = self.is_render_wanted
+            self.renderer2.is_wanted = self.is_render_wanted
+            self.renderRequested.connect(self.renderer1.render)
+            self.renderer1.rendered.connect(self.set_rendered_image)
+            self.renderRequested.connect(self.renderer2.render)
+            self.loadFileRequested.connect(self.renderer2.load_document)
+            self.closeFileRequested.connect(self.renderer1.close_document)
+            self.closeFileRequested.connect(self.renderer2.close_document)
+            self.colorModeRequested.connect(self.renderer1.set_color_mode)
+            self.colorModeRequested.connect(self.renderer2.set_color_mode)
+            self.renderer2.rendered.connect(self.set_rendered_image)
         self.thread3 = QtCore.QThread(self)
         self.translator = Translator(self)
         self.translator.moveToThread(self.thread3)
         self.translator.selectionTranslateReady.connect(self.show_selection)
+        self.loadFileRequested.connect(self.translator.load_document)
+        self.translator.blocksTranslated.connect(self.on_blocks_translated)
+        self.translator.is_page_wanted = self.is_translation_wanted
+        self.blocksTranslationRequested.connect(self.translator.translate_blocks)
         self.thread3.start()
+        self.thread5 = QtCore.QThread(self)
+        self.documentLoader = DocumentLoader()
+        self.documentLoader.moveToThread(self.thread5)
+        self.openDocumentRequested.connect(self.documentLoader.load)
+        self.documentLoader.opened.connect(self.on_document_opened)
+        self.documentLoader.geometryReady.connect(self.on_geometry_ready)
+        self.documentLoader.outlineReady.connect(self.on_outline_ready)
+        self.documentLoader.loaded.connect(self.on_document_loaded)
+        self.reloadDocumentRequested.connect(self.documentLoader.reload)
+        self.documentLoader.reloaded.connect(self.on_document_reloaded)
+        self.documentLoader.failed.connect(self.on_document_failed)
+        self.thread5.start()
+        self.thread4 = QtCore.QThread(self)
+        self.thumbnailRenderer = ThumbnailRenderer()
+        self.thumbnailRenderer.moveToThread(self.thread4)
+        self.loadFileRequested.connect(self.thumbnailRenderer.load_document)
+        self.thumbnailBatchRequested.connect(self.thumbnailRenderer.render_batch)
+        self.thumbnailRenderer.thumbnailReady.connect(self.on_thumbnail_ready)
+        self.thread4.start()
+        self.thread6 = QtCore.QThread(self)
+        self.searchIndexer = SearchIndexer()
+        self.searchIndexer.moveToThread(self.thread6)
+        self.indexDocumentRequested.connect(self.searchIndexer.build)
+        self.searchIndexer.indexReady.connect(self.on_search_index_ready)
+        self.thread6.start()
+        self.thread7 = QtCore.QThread(self)
+        self.searcher = Searcher()
+        self.searcher.moveToThread(self.thread7)
+        self.loadFileRequested.connect(self.searcher.load_document)
+        self.searchRequested.connect(self.searcher.search)
+        self.searcher.hitsFound.connect(self.on_hits_found)
+        self.searcher.searchFinished.connect(self.on_search_finished)
+        self.thread7.start()
+        self.thread8 = QtCore.QThread(self)
+        self.pretranslator = Pretranslator(translate_batch, MODEL_NAME)
+        self.pretranslator.moveToThread(self.thread8)
+        self.loadFileRequested.connect(self.pretranslator.load_document)
+        self.pretranslateRequested.connect(self.pretranslator.run)
+        self.pretranslator.pageTranslated.connect(self.on_page_pretranslated)
+        self.thread8.start()
         self.threadPool = QtCore.QThreadPool(self)
         self.threadPool.setMaxThreadCount(1)
+        # compresses page images that are removed from the screen
+        self.cachePool = QtCore.QThreadPool(self)
+        self.cachePool.setMaxThreadCount(1)
+        # composes translation overlays, a selection being translated does not wait for them
+        self.overlayPool = QtCore.QThreadPool(self)
+        self.overlayPool.setMaxThreadCount(1)
+        self.compressed_pages = CompressedImageCache()
+        # pages with translations drawn over them, keyed by (page_no, MODEL_NAME) and dpi
+        self.overlay_pages = CompressedImageCache()
+        self.overlayReady.connect(self.on_overlay_ready)
         # copy text
         self.shortcut_copy_text = QShortcut(QKeySequence("Ctrl+C"), self)
         self.shortcut_copy_text.activated.connect(self.copy_text)
         self.shortcut_copy_translated = QShortcut(QKeySequence("Ctrl+X"), self)
         self.shortcut_copy_translated.activated.connect(self.copy_translated)
         # Initialize Variables
-        self.doc: pymupdf.Document = None
+        self.doc: pymupdf.Document = None  # set when the document loader finishes
+        self.load_generation = 0
         self.filename = ''
+        self.doc_hash = ''  # content hash of the file, names its cache directory
         self.password = ''
         self.pages = []
         self.pages_count = 0
         self.rendered_pages = []
         self.current_page = 1
         self.jumped_from = None
-        self.max_preload = 1
+        self.prefetch_window = set()
+        self.jump_targets = []  # pages the user may jump to, from outline and search
+        self.render_requested_at = {}
+        self.render_time = 0.15  # seconds to get a requested page, moving average
         self.scroll_render_lock = False
+        self.page_sizes = []  # page sizes in points
+        self.page_offsets = []  # top of every page in frame coordinates, and the bottom of the last page
+        self.pending_resize = []
+        self.scroll_anchor = None
+        self.last_scroll_pos = 0
+        self.last_scroll_time = QtCore.QElapsedTimer()
+        self.last_scroll_time.start()
+        self.scroll_velocity = 0.0  # pages per second
+        self.scroll_direction = 1  # 1 for down, -1 for up
         self.frame = None
         self.verticalLayout = None
         self.search_text = ""
         self.search_result_page = 0
-        self.text = {}
-        self.text_rect = {}
-        self.text_translated = {}
+        self.index_generation = 0
+        self.search_generation = 0
+        self.search_running = False
+        self.pending_find = None  # (from page, reverse) of a find waiting for hits
+        self.selection_page = 0  # page showing the selection
+        self.page_texts = {}  # page_no: PageText, text of a page is extracted once
         self.selection_translated = ""
         self.selection_text = ""
+        self.selection_key = None  # (page_no, offset of the first word) of the selected text
+        self.selection_sentences = []  # (offset, text) of the sentences holding the selection
         self.popup = None
+        self.popups = {}  # win_type: Popup, popups are reused
+        self.hovered_word = None  # (page_no, word count) waiting for the dwell timer
         self.active_word = {
             "page": None,
             "count": None
@@ -293,6 +679,14 @@ class Window(QMainWindow, Ui_window):
         self.painter = None
         self.dock_search_status = False
         self.dock_widget_status = False
+        self.dock_thumbnails_status = False
+        self.reflow_status = False
+        self.overlay_status = False
+        self.page_translations = {}  # page_no: (block texts, translations)
+        self.overlay_translating = set()  # pages sent to the translator for the overlay
+        self.pretranslate_status = False
+        self.pretranslate_generation = 0
+        self.pretranslated_pages = 0
         # Show Window
         width = int(self.settings.value("WindowWidth", 1040))
         height = int(self.settings.value("WindowHeight", 717))
@@ -310,23 +704,39 @@ class Window(QMainWindow, Ui_window):
             self.load_pdf(filename)
 
     def load_pdf(self, filename):
-        """ Loads pdf document in all threads """
+        """ Loads pdf document in all threads, it is opened in the background """
         filename = os.path.expanduser(filename)
-        doc = pymupdf.open(filename)
-        if not doc:
+        self.load_generation += 1
+        self.documentLoader.generation = self.load_generation
+        self.openDocumentRequested.emit(self.load_generation, filename)
+
+    def on_document_opened(self, generation, filename, doc_hash, pages_count, width, height):
+        # Pages are shown as soon as the page count is known, sizes of unread pages are
+        # estimated from the first page
+        if generation != self.load_generation:
             return
         password = ''
 
         self.remove_old_doc()
 
-        self.doc = doc
         self.filename = filename
-        self.pages_count = self.doc.page_count
+        self.doc_hash = doc_hash
+        if self.fileWatcher.files():
+            self.fileWatcher.removePaths(self.fileWatcher.files())
+        self.fileWatcher.addPath(self.filename)
+        self.pages_count = pages_count
+        self.page_sizes = [(width, height)] * pages_count
         self.current_page = 1
         self.rendered_pages = []
-        self.get_outlines(self.doc)
+        self.thumbnailView.setModel(ThumbnailModel(self.pages_count, self.thumbnailView))
+        reflow_model = ReflowModel(self.pages_count, self.page_blocks, self.reflowView)
+        reflow_model.translationsRequested.connect(self.translator.translate_blocks)
+        self.reflowView.setModel(reflow_model)
+        if self.reflow_status:
+            self.reflowView.show_page(self.current_page)
         # Load Document in other threads
-        self.loadFileRequested.emit(self.filename, password)
+        self.loadFileRequested.emit(self.filename, password, self.doc_hash)
+        self.start_pretranslation()
         if collapse_user(self.filename) in self.history_filenames:
             self.current_page = int(self.history_page_no[self.history_filenames.index(collapse_user(self.filename))])
         self.current_page = min(self.current_page, self.pages_count)
@@ -344,22 +754,147 @@ class Window(QMainWindow, Ui_window):
         self.frame.sendSelectionToTranslateRequest.connect(self.send_selection_to_translate)
         self.frame.showStatusRequested.connect(self.show_status)
 
-        # Render 4 pages, (Preload 3 pages)
-        self.max_preload = min(4, self.pages_count)
         # Add pages
         for i in range(self.pages_count):
             page = PageWidget(i + 1, self.frame)
             self.verticalLayout.addWidget(page, 0, QtCore.Qt.AlignCenter)
             self.pages.append(page)
+        self.scroll_anchor = (self.current_page, 0.0)  # pages are laid out at the last read page
         self.resize_pages()
         self.gotoPageEdit.setPlaceholderText(str(self.current_page) + " / " + str(self.pages_count))
         self.gotoPageValidator.setTop(self.pages_count)
         self.setWindowTitle(os.path.basename(self.filename) + " - PdfTranslator")
-        if self.current_page != 1:
-            QtCore.QTimer.singleShot(150 + self.pages_count // 3, self.jump_current_page)
+
+    def on_geometry_ready(self, generation, first_page, sizes):
+        if generation != self.load_generation:
+            return
+        changed = [first_page + i for i, size in enumerate(sizes) if self.page_sizes[first_page - 1 + i] != size]
+        self.page_sizes[first_page - 1:first_page - 1 + len(sizes)] = sizes
+        if changed:
+            self.resize_pages(changed)
+
+    def on_outline_ready(self, generation, outlines):
+        if generation != self.load_generation:
+            return
+        self.get_outlines(outlines)
+
+    def on_document_loaded(self, generation, doc):
+        if generation != self.load_generation:
+            doc.close()
+            return
+        self.doc = doc
+        # text of pages rendered before the document was ready
+        for page_no in self.rendered_pages:
+            if not self.pages[page_no - 1].image.isNull():
+                self.extract_page_text(page_no)
+                if self.overlay_status:
+                    self.request_overlay(page_no)
+        self.reflowView.requestTimer.start(0)
+        self.build_search_index()
+
+    def on_file_changed(self, path):
+        if path != self.filename:
+            return
+        # a half written file can render without errors but wrong, renderers wait for the reload
+        # and renders in flight are requested again after it
+        self.closeFileRequested.emit()
+        self.drop_render_requests(self.rendered_pages)
+        self.reloadTimer.start(RELOAD_DELAY_MS)
+
+    def reload_pdf(self):
+        """ Reloads the changed file, only pages whose content changed are rendered again """
+        if not self.pages:
+            return
+        if not os.path.exists(self.filename):
+            # the file is replaced by a new one, it is not there for a moment
+            self.reloadTimer.start(RELOAD_DELAY_MS)
+            return
+        # replacing the file removes it from the watcher
+        if self.filename not in self.fileWatcher.files():
+            self.fileWatcher.addPath(self.filename)
+        if self.doc is None:  # first loading is not finished, it has to start again
+            self.load_pdf(self.filename)
+            return
+        self.reloadDocumentRequested.emit(self.load_generation, self.filename)
+
+    def on_document_reloaded(self, generation, doc, doc_hash, sizes, changed):
+        if generation != self.load_generation or self.doc is None:
+            doc.close()
+            return
+        debug("Changed pages :", changed)
+        old_count = self.pages_count
+        self.doc.close()
+        self.doc = doc
+        # renderers open the new file, requests sent from now on use it
+        self.stop_pretranslation()
+        self.doc_hash = doc_hash
+        self.loadFileRequested.emit(self.filename, '', self.doc_hash)
+        self.drop_render_requests(self.rendered_pages)
+        self.start_pretranslation()
+        self.set_pages_count(len(sizes))
+        resized = [page_no for page_no, size in enumerate(sizes, 1)
+                   if page_no > old_count or self.page_sizes[page_no - 1] != size]
+        self.page_sizes = sizes
+        for page_no in changed:
+            self.forget_page(page_no)
+        if resized or self.pages_count != old_count:
+            self.resize_pages(resized)
+        else:
+            self.render_current_page()
+        self.thumbnailView.request_thumbnails()
+        self.reflowView.requestTimer.start(0)
+        self.build_search_index()
+        if self.search_text:  # hits of the old file are replaced
+            self.start_search()
+
+    def set_pages_count(self, pages_count):
+        # Adds or removes page widgets at the end of the document after a reload
+        for page_no in range(pages_count + 1, self.pages_count + 1):
+            self.forget_page(page_no)
+        while len(self.pages) > pages_count:
+            page = self.pages.pop()
+            self.verticalLayout.removeWidget(page)
+            page.deleteLater()
+        for page_no in range(len(self.pages) + 1, pages_count + 1):
+            page = PageWidget(page_no, self.frame)
+            self.verticalLayout.addWidget(page, 0, QtCore.Qt.AlignCenter)
+            self.pages.append(page)
+        if pages_count == self.pages_count:
+            return
+        self.page_sizes = self.page_sizes[:pages_count] + [self.page_sizes[-1]] * (pages_count - self.pages_count)
+        self.pages_count = pages_count
+        self.thumbnailView.model().set_pages_count(pages_count)
+        self.reflowView.model().set_pages_count(pages_count)
+        self.jump_targets = [page_no for page_no in self.jump_targets if page_no <= pages_count]
+        self.current_page = min(self.current_page, pages_count)
+        self.gotoPageEdit.setPlaceholderText(str(self.current_page) + " / " + str(self.pages_count))
+        self.gotoPageValidator.setTop(self.pages_count)
+
+    def forget_page(self, page_no):
+        # Drops everything known about the content of a page
+        if page_no in self.rendered_pages:
+            self.rendered_pages.remove(page_no)
+        if page_no <= len(self.pages):
+            page = self.pages[page_no - 1]
+            page.clear()
+            page.highlight_area = None
+            page.selection_words = []
+            page.annots_listed = False
+        self.page_texts.pop(page_no, None)
+        self.page_translations.pop(page_no, None)
+        self.overlay_pages.discard((page_no, MODEL_NAME))
+        self.translator.forget_page(page_no)
+        self.compressed_pages.discard(page_no)
+        self.thumbnailView.model().remove_thumbnail(page_no)
+        self.reflowView.model().remove_page(page_no)
+
+    def on_document_failed(self, generation, filename, error):
+        if generation != self.load_generation:
+            return
+        print(f"Can not open {filename}: {error}")
 
     def remove_old_doc(self):
-        if not self.doc:
+        if not self.pages:
             return
         # Save current page number
         # self.save_file_data()
@@ -369,65 +904,238 @@ class Window(QMainWindow, Ui_window):
         for i in range(len(self.pages)):
             self.pages.pop().deleteLater()
         self.frame.deleteLater()
+        if self.doc:
+            self.doc.close()
+        self.doc = None
+        self.page_texts.clear()
+        self.page_translations.clear()
+        self.overlay_translating.clear()
+        self.overlay_pages.clear()
+        self.selection_page = 0
+        self.hoverTimer.stop()
+        self.hovered_word = None
+        self.kill_popup()
+        self.active_word["page"] = None
+        self.active_word["count"] = None
+        self.page_offsets = []
+        self.pending_resize = []
+        self.scroll_anchor = None
         self.jumped_from = None
+        self.jump_targets = []
+        self.render_requested_at.clear()
+        self.thumbnailRenderer.generation = -1  # stops the running thumbnail batch
+        self.searchIndexer.generation = -1
+        self.searcher.index = None
+        self.stop_pretranslation()
+        self.cancel_search()
+        self.search_result_page = 0
+        old_model = self.thumbnailView.model()
+        self.thumbnailView.setModel(None)
+        old_model.deleteLater()
+        old_model = self.reflowView.model()
+        self.reflowView.setModel(None)
+        old_model.deleteLater()
+        self.cachePool.clear()
+        self.cachePool.waitForDone()
+        self.compressed_pages.clear()
 
     # ------------------------- Rendering
 
-    def set_rendered_image(self, page_no, image):
+    def set_rendered_image(self, page_no, dpi, image, draft=False):
         # takes a QImage and sets pixmap of the specified page
         # when number of rendered pages exceeds a certain number, old page image is
         # deleted to save memory
         debug("Set Rendered Image :", page_no)
-        self.pages[page_no - 1].set_page_data(page_no, QPixmap.fromImage(image), self.doc[page_no - 1])
-        # Request to render next page
-        if self.current_page <= page_no < (self.current_page + self.max_preload - 2):
-            if (page_no + 2 not in self.rendered_pages) and (page_no + 2 <= self.pages_count):
-                self.rendered_pages.append(page_no + 2)
-                self.renderRequested.emit(page_no + 2, self.pages[page_no + 1].dpi)
-        # Replace old rendered pages with blank image
-        if len(self.rendered_pages) > 10:
-            cleared_page_no = self.rendered_pages.pop(0)
-            debug("Clear Page :", cleared_page_no)
-            self.pages[cleared_page_no - 1].clear()
+        page = self.pages[page_no - 1]
+        if dpi != page.requested_dpi:
+            return  # rendered for a zoom level the user skipped, or a newer request replaced it
+        page.is_draft = draft
+        page.image_dpi = dpi
+        page.set_page_data(page_no, image)
+        requested_at = self.render_requested_at.pop(page_no, None)
+        if requested_at is not None:
+            self.render_time = 0.7 * self.render_time + 0.3 * (time.monotonic() - requested_at)
         debug("Rendered Pages :", self.rendered_pages)
         debug("current_page :", self.current_page)
         debug("page_no :", page_no)
-        text_info_list: str = self.doc[page_no - 1].get_text("words")
-        send_text_to_translation = []
-        self.text[page_no - 1] = []
-        self.text_rect[page_no - 1] = []
-        self.text_translated[page_no - 1] = []
-        for i in text_info_list:
-            self.text[page_no - 1].append(i[4])
-            self.text_translated[page_no - 1].append(i[4])
-            send_text_to_translation.append(i[4])
-            self.text_rect[page_no - 1].append(i[0:4])
-
-    def render_current_page(self):
-        # Requests to render current page. if it is already rendered, then request
-        # to render next unrendered page
-        requested = 0
-        for page_no in range(self.current_page, self.current_page + self.max_preload):
-            if (page_no not in self.rendered_pages) and (page_no <= self.pages_count):
-                self.rendered_pages.append(page_no)
-                self.renderRequested.emit(page_no, self.pages[page_no - 1].dpi)
-                requested += 1
+        if self.doc is not None:  # otherwise it is extracted when the document loader finishes
+            self.extract_page_text(page_no)
+            if self.overlay_status:
+                self.request_overlay(page_no)
+
+    def extract_page_text(self, page_no):
+        # text does not depend on zoom, a page rendered again keeps its text
+        if page_no not in self.page_texts:
+            self.page_texts[page_no] = PageText(self.doc[page_no - 1])
+
+    def render_current_page(self, draft=False):
+        # Requests pages on the screen, then pages ahead in scroll direction, one page behind
+        # and the jump targets. Requests of pages that left this window are dropped
+        if self.pages_count == 0:
+            return
+        first_page = self.current_page
+        last_page = max(first_page, self.page_at(self.page_offsets[first_page - 1] + self.scrollArea.viewport().height()))
+        step = self.scroll_direction
+        edge = last_page if step > 0 else first_page
+        window = list(range(first_page, last_page + 1))
+        window += [edge + step * i for i in range(1, self.prefetch_depth() + 1)]
+        window.append(first_page - 1 if step > 0 else last_page + 1)
+        window += self.jump_targets
+        window = [page_no for page_no in dict.fromkeys(window) if 1 <= page_no <= self.pages_count]
+        self.prefetch_window = set(window)
+        self.pretranslator.center_page = first_page
+        self.drop_stale_requests()
+        for page_no in window:
+            if self.needs_render(page_no, draft):
+                if page_no not in self.rendered_pages:
+                    self.rendered_pages.append(page_no)
+                self.request_render(page_no, draft)
                 debug("Render Requested :", page_no)
-                if requested == 2:
-                    return
+        self.clear_far_pages()
+
+    def prefetch_depth(self):
+        # While a page is being rendered the user moves scroll_velocity * render_time pages
+        if self.scroll_velocity < 0.1:
+            return PREFETCH_MIN
+        depth = math.ceil(2 * self.scroll_velocity * self.render_time) + 1
+        return min(max(depth, PREFETCH_MIN), PREFETCH_MAX)
+
+    def drop_stale_requests(self):
+        # Renderers skip requests whose dpi is not requested anymore
+        self.drop_render_requests([page_no for page_no in self.rendered_pages if page_no not in self.prefetch_window])
+
+    def drop_render_requests(self, pages):
+        # Pages waiting for a render keep their current image, they are requested again when needed
+        for page_no in list(pages):
+            page = self.pages[page_no - 1]
+            if page.requested_dpi == page.image_dpi:
+                continue
+            page.requested_dpi = page.image_dpi
+            page.requested_draft = page.is_draft
+            self.render_requested_at.pop(page_no, None)
+            if page.image.isNull():
+                self.rendered_pages.remove(page_no)
+
+    def clear_far_pages(self):
+        # Replace rendered pages far from the current page with blank image, the image is kept compressed
+        max_rendered = max(10, len(self.prefetch_window) + 2)
+        while len(self.rendered_pages) > max_rendered:
+            cleared_page_no = max(self.rendered_pages, key=lambda page_no: abs(page_no - self.current_page))
+            if cleared_page_no in self.prefetch_window:
+                return
+            debug("Clear Page :", cleared_page_no)
+            self.rendered_pages.remove(cleared_page_no)
+            self.stash_page_image(cleared_page_no)
+            self.pages[cleared_page_no - 1].clear()
+            # text goes with the image, it is extracted again when the page comes back
+            if cleared_page_no != self.selection_page:
+                self.page_texts.pop(cleared_page_no, None)
+
+    def add_jump_target(self, page_no):
+        if page_no in self.jump_targets:
+            return
+        self.jump_targets = [page_no] + self.jump_targets[:3]
+        self.render_current_page()
+
+    def needs_render(self, page_no, draft=False):
+        # Pages showing a draft or an image of an old zoom level are rendered again
+        if page_no > self.pages_count:
+            return False
+        page = self.pages[page_no - 1]
+        if page_no not in self.rendered_pages:
+            return True
+        # the requested quality decides, a full render may be requested while a draft is still on the way
+        if page.requested_dpi == page.dpi and not page.requested_draft:
+            return False
+        return not draft or not page.requested_draft or page.requested_dpi != page.dpi * DRAFT_DPI_SCALE
+
+    def request_render(self, page_no, draft=False):
+        # Restores the page from compressed images if it was rendered with the same dpi before
+        page = self.pages[page_no - 1]
+        dpi = page.dpi
+        image = self.compressed_pages.get(page_no, dpi)
+        if image is not None:
+            debug("Restore Compressed Page :", page_no)
+            page.requested_dpi = dpi
+            page.requested_draft = False
+            self.set_rendered_image(page_no, dpi, image)
+            return
+        if draft:
+            dpi *= DRAFT_DPI_SCALE
+        page.requested_dpi = dpi
+        page.requested_draft = draft
+        self.render_requested_at[page_no] = time.monotonic()
+        self.renderRequested.emit(page_no, dpi, draft)
+
+    def is_render_wanted(self, page_no, dpi):
+        """ Called from renderer threads, skips requests of zoom levels the user has already passed """
+        pages = self.pages
+        return page_no <= len(pages) and pages[page_no - 1].requested_dpi == dpi
+
+    def set_color_mode(self, action):
+        # Pages are rendered again in the chosen mode, images of the old mode are dropped
+        self.color_mode = action.data()
+        self.settings.setValue("ColorMode", self.color_mode)
+        self.colorModeRequested.emit(self.color_mode)
+        self.cachePool.clear()
+        self.cachePool.waitForDone()
+        self.compressed_pages.clear()
+        self.overlay_pages.clear()
+        for page_no in list(self.rendered_pages):
+            page = self.pages[page_no - 1]
+            if page_no in self.prefetch_window:
+                page.requested_dpi = 0  # the old image is shown until the new one arrives
+            else:
+                self.rendered_pages.remove(page_no)
+                page.clear()
+        self.render_current_page()
+
+    def stash_page_image(self, page_no):
+        page = self.pages[page_no - 1]
+        if page.image.isNull() or page.is_draft:
+            return
+        worker = Worker(self.compressed_pages.put, page_no, page.image_dpi, page.image)
+        self.cachePool.start(worker)
 
     # ------------------------- Moving On Pages
 
     def on_mouse_scroll(self, pos):
         # It is called when vertical scrollbar value is changed.
         # Get the current page number on scrolling, then requests to render
-        index = self.verticalLayout.indexOf(self.frame.childAt(int(self.frame.width() / 2), pos))
+        index = self.page_at(pos) - 1
         if index == -1:
             return
+        self.pause_pretranslation()
         self.gotoPageEdit.setPlaceholderText(str(index + 1) + " / " + str(self.pages_count))
-        if self.scrollArea.verticalScrollBar().isSliderDown() or self.scroll_render_lock:
+        if self.scroll_render_lock:
             return
+        self.update_scroll_velocity(pos, self.pages[index].height())
+        if index + 1 != self.current_page:
+            self.thumbnailView.set_current_page(index + 1)
         self.current_page = index + 1
+        draft = self.scrollArea.verticalScrollBar().isSliderDown() or self.scroll_velocity > FAST_SCROLL_PAGES_PER_SEC
+        self.render_current_page(draft)
+        if draft:
+            self.scrollSettleTimer.start(150)
+
+    def update_scroll_velocity(self, pos, page_height):
+        elapsed = self.last_scroll_time.restart()
+        distance = abs(pos - self.last_scroll_pos) / max(page_height, 1)
+        if pos != self.last_scroll_pos:
+            self.scroll_direction = 1 if pos > self.last_scroll_pos else -1
+        self.last_scroll_pos = pos
+        if elapsed > 300:  # scrolling started again
+            self.scroll_velocity = 0.0
+            return
+        # smooth the velocity, wheel and scrollbar events come in bursts
+        self.scroll_velocity = 0.5 * self.scroll_velocity + 0.5 * distance * 1000 / max(elapsed, 1)
+
+    def on_scroll_settle(self):
+        # Replaces draft images of the pages where the user settled with full quality renders
+        if self.scrollArea.verticalScrollBar().isSliderDown():
+            self.scrollSettleTimer.start(150)
+            return
+        self.scroll_velocity = 0.0
         self.render_current_page()
 
     def on_slider_release(self):
@@ -447,9 +1155,13 @@ class Window(QMainWindow, Ui_window):
             top = 0
         self.jumped_from = self.current_page
         self.current_page = page_num
-        scrollbar_pos = self.pages[page_num - 1].pos().y()
-        scrollbar_pos += top * self.pages[page_num - 1].height()
+        scrollbar_pos = self.page_offsets[page_num - 1]
+        scrollbar_pos += top * self.page_pixel_size(page_num)[1]
+        self.last_scroll_pos = int(scrollbar_pos)  # a jump is not scrolling, it does not change the velocity
+        self.add_jump_target(self.jumped_from)  # for jump undo
         self.scrollArea.verticalScrollBar().setValue(int(scrollbar_pos))
+        if self.reflow_status:
+            self.reflowView.show_page(page_num)
 
     def jump_undo(self):
         if self.jumped_from is None:
@@ -485,48 +1197,123 @@ class Window(QMainWindow, Ui_window):
     def get_available_width(self):
         # Returns available width for rendering a page
         dock_width = 0 if self.dockWidget.isHidden() else self.dockWidget.width()
+        dock_width += 0 if self.dockThumbnails.isHidden() else self.dockThumbnails.width()
         return self.width() - dock_width - 50
 
-    def resize_pages(self):
-        # Resize all pages according to zoom level
+    def resize_pages(self, pages=None):
+        # Resize pages according to zoom level, all pages if pages is None. Pages on the screen are
+        # resized and rendered first, the others are resized in batches from the event loop
+        self.scroll_anchor = self.get_scroll_anchor()
         page_dpi = self.zoom_levels[self.zoomLevelCombo.currentIndex()] * SCREEN_DPI / 100
         fixed_width = self.get_available_width()
-        for i in range(self.pages_count):
-            pg_width = self.doc[i].rect.width  # width in points
-            pg_height = self.doc[i].rect.height
+        if pages is None:
+            pages = range(1, self.pages_count + 1)
+        for page_no in pages:
             if self.zoomLevelCombo.currentIndex() == 0:  # if fixed width
-                dpi = 72.0 * fixed_width / pg_width
+                self.pages[page_no - 1].dpi = 72.0 * fixed_width / self.page_sizes[page_no - 1][0]
             else:
-                dpi = page_dpi
-            self.pages[i].dpi = dpi
-            self.pages[i].setFixedSize(int(pg_width * dpi / 72.0), int(pg_height * dpi / 72.0))
-        for page_no in self.rendered_pages:
-            self.pages[page_no - 1].clear()
-        self.rendered_pages = []
+                self.pages[page_no - 1].dpi = page_dpi
+        self.update_page_offsets()
+        first_page = self.scroll_anchor[0] if self.scroll_anchor else self.current_page
+        last_page = first_page
+        visible_height = self.page_pixel_size(first_page)[1]
+        while visible_height < self.scrollArea.viewport().height() and last_page < self.pages_count:
+            last_page += 1
+            visible_height += self.page_pixel_size(last_page)[1]
+        resized = set(pages).union(self.pending_resize)
+        visible = [i for i in range(first_page, last_page + 1) if i in resized]
+        self.pending_resize = visible + sorted(i for i in resized if not first_page <= i <= last_page)
+        self.scroll_render_lock = True  # rendering on scroll is locked until scroll position is restored
+        self.resize_next_pages()
         # self.translator.already_translated = []
         self.render_current_page()
 
+    def resize_next_pages(self):
+        self.restore_scroll_anchor()
+        batch = self.pending_resize[:RESIZE_BATCH]
+        del self.pending_resize[:RESIZE_BATCH]
+        for page_no in batch:
+            page = self.pages[page_no - 1]
+            page.setFixedSize(*self.page_pixel_size(page_no))
+            # rendered pages keep showing their old images scaled to the new size until new renders arrive
+            if page_no in self.rendered_pages:
+                page.update_image()
+        if self.pending_resize:
+            QtCore.QTimer.singleShot(0, self.resize_next_pages)
+        else:
+            # layout of the last batch is done in the event loop
+            QtCore.QTimer.singleShot(0, self.finish_resize)
+
+    def finish_resize(self):
+        if self.pending_resize:
+            return
+        self.restore_scroll_anchor()
+        self.scroll_anchor = None
+        self.last_scroll_pos = self.scrollArea.verticalScrollBar().value()
+        self.scroll_render_lock = False
+        self.on_mouse_scroll(self.scrollArea.verticalScrollBar().value())
+
+    def page_pixel_size(self, page_no):
+        pg_width, pg_height = self.page_sizes[page_no - 1]
+        dpi = self.pages[page_no - 1].dpi
+        return int(pg_width * dpi / 72.0), int(pg_height * dpi / 72.0)
+
+    def update_page_offsets(self):
+        # Page positions follow from page sizes, the layout spacing and the frame margins
+        margins = self.verticalLayout.contentsMargins()
+        spacing = self.verticalLayout.spacing()
+        y = self.frame.frameWidth() + margins.top()
+        self.page_offsets = []
+        for page_no in range(1, self.pages_count + 1):
+            self.page_offsets.append(y)
+            y += self.page_pixel_size(page_no)[1] + spacing
+        self.page_offsets.append(y - spacing)
+
+    def page_at(self, pos):
+        """ Returns the page number at the given scroll position, 0 if there is no page """
+        if not self.page_offsets:
+            return 0
+        index = bisect.bisect_right(self.page_offsets, pos, hi=self.pages_count) - 1
+        return min(max(index, 0), self.pages_count - 1) + 1
+
+    def get_scroll_anchor(self):
+        """ Returns page number and the distance of the viewport top to the page top in points """
+        if self.scroll_anchor is not None:  # a resize is still in progress
+            return self.scroll_anchor
+        pos = self.scrollArea.verticalScrollBar().value()
+        page_no = self.page_at(pos)
+        if page_no == 0:
+            return None
+        offset = (pos - self.page_offsets[page_no - 1]) * 72.0 / self.pages[page_no - 1].dpi
+        return page_no, max(offset, 0.0)
+
+    def restore_scroll_anchor(self):
+        # page_offsets hold the new layout already, the layouts are run first so the scroll range fits it
+        if self.scroll_anchor is None:
+            return
+        self.verticalLayout.activate()
+        self.horizontalLayout_2.activate()
+        page_no, offset = self.scroll_anchor
+        self.scrollArea.verticalScrollBar().setValue(
+            int(self.page_offsets[page_no - 1] + offset * self.pages[page_no - 1].dpi / 72.0))
+
     def resizeEvent(self, ev):
         QMainWindow.resizeEvent(self, ev)
         if self.filename == '': return
         if self.zoomLevelCombo.currentIndex() == 0:
-            self.resize_page_timer.start(200)
+            self.resizePageTimer.start(200)
 
     def on_window_resize(self):
         for i in range(self.pages_count):
             self.pages[i].annots_listed = False  # Clears prev link annotation positions
         self.resize_pages()
-        wait(300)
-        self.jump_current_page()
         if not self.isMaximized():
             self.settings.setValue("WindowWidth", self.width())
             self.settings.setValue("WindowHeight", self.height())
 
     def set_zoom(self, index):
         """ Gets called when zoom level is changed"""
-        self.scroll_render_lock = True  # rendering on scroll is locked as set scroll position
         self.resize_pages()
-        QtCore.QTimer.singleShot(300, self.zoom_after)
 
     def zoom_in(self):
         index = self.zoomLevelCombo.currentIndex()
@@ -542,109 +1329,178 @@ class Window(QMainWindow, Ui_window):
         self.zoomLevelCombo.setCurrentIndex(index - 1)
         self.set_zoom(index - 1)
 
-    def zoom_after(self):
-        scrollbar_pos = self.pages[self.current_page - 1].pos().y()
-        self.scrollArea.verticalScrollBar().setValue(scrollbar_pos)
-        self.scroll_render_lock = False
-
     # ------------------------- Search Text
 
     def dock_search_open_hide(self):
         if not self.dock_search_status:
             self.dockSearch.show()
+            self.dockSearchResults.show()
         else:
             self.dockSearch.hide()
+            self.dockSearchResults.hide()
         self.dock_search_status = not self.dock_search_status
 
     def dock_find_open_hide(self, enable):
         if enable:
             self.findTextEdit.setText('')
             self.findTextEdit.setFocus()
-            self.search_text = ''
-            self.search_result_page = 0
-        elif self.search_result_page != 0:
-            self.pages[self.search_result_page - 1].highlight_area = None
-            self.pages[self.search_result_page - 1].update_image()
+        else:
+            self.cancel_search()
+            self.clear_search_highlight()
+
+    def on_find_text_changed(self, text):
+        # a running search is stopped at once, the new one starts when typing pauses
+        self.cancel_search()
+        self.clear_search_highlight()
+        if text.strip():
+            self.searchTimer.start(SEARCH_DELAY_MS)
+
+    def start_search(self):
+        self.cancel_search()
+        self.search_text = self.findTextEdit.text()
+        if not self.search_text.strip() or self.pages_count == 0:
+            return
+        self.search_running = True
+        self.searchCountLabel.setText("Searching...")
+        self.searchRequested.emit(self.search_generation, self.search_text, self.current_page)
+
+    def cancel_search(self):
+        self.searchTimer.stop()
+        self.search_generation += 1
+        self.searcher.generation = self.search_generation
+        self.search_running = False
+        self.search_text = ""
+        self.pending_find = None
+        self.searchResultsModel.clear()
+        self.searchCountLabel.setText("")
 
-    def find_next(self):
-        """ search text in current page and next pages """
-        text = self.findTextEdit.text()
-        if text == "":
+    def on_hits_found(self, generation, hits):
+        if generation != self.search_generation:
             return
-        # search from current page when text changed
-        if self.search_text != text or self.search_result_page == 0:
-            search_from_page = self.current_page
-        else:
-            search_from_page = self.search_result_page + 1
-        self.findTextRequested.emit(text, search_from_page, False)
-        if self.search_result_page != 0:  # clear previous highlights
-            self.pages[self.search_result_page - 1].highlight_area = None
-            self.pages[self.search_result_page - 1].update_image()
-            self.search_result_page = 0
-        self.search_text = text
+        self.searchResultsModel.add_hits(hits)
+        self.searchCountLabel.setText(f"{self.searchResultsModel.total} matches...")
+        # pages are searched forward from the current page, the first hit found after it is the next one
+        if self.pending_find is not None and not self.pending_find[1]:
+            self.find_hit(*self.pending_find)
+
+    def on_search_finished(self, generation, total):
+        if generation != self.search_generation:
+            return
+        self.search_running = False
+        self.searchCountLabel.setText(f"{total} matches on {len(self.searchResultsModel.pages)} pages")
+        if self.pending_find is not None:
+            self.find_hit(*self.pending_find)
+            self.pending_find = None
+
+    def find_next(self):
+        """ shows the hits of the next page that has hits """
+        self.find_hit(None, False)
 
     def find_back(self):
-        """ search text in pages before current page """
-        text = self.findTextEdit.text()
-        if text == "":
+        """ shows the hits of the previous page that has hits """
+        self.find_hit(None, True)
+
+    def find_hit(self, from_page, reverse):
+        # A page that is not searched yet is shown when its hits arrive
+        if self.findTextEdit.text() != self.search_text:
+            self.start_search()
+        if not self.search_text.strip():
             return
-        if self.search_text != text or self.search_result_page == 0:
-            search_from_page = self.current_page
-        else:
-            search_from_page = self.search_result_page - 1
-        self.findTextRequested.emit(text, search_from_page, True)
+        if from_page is None:
+            if self.search_result_page == 0:
+                from_page = self.current_page
+            else:
+                from_page = self.search_result_page + (-1 if reverse else 1)
+        model = self.searchResultsModel
+        page_no = model.page_before(from_page) if reverse else model.page_after(from_page)
+        if page_no is not None:
+            self.pending_find = None
+            self.show_search_hit(page_no)
+        elif self.search_running:
+            self.pending_find = (from_page, reverse)
+
+    def on_search_result_click(self, index):
+        self.pending_find = None
+        self.show_search_hit(self.searchResultsModel.pages[index.row()])
+
+    def show_search_hit(self, page_no):
+        model = self.searchResultsModel
+        self.clear_search_highlight()
+        self.searchResultsView.setCurrentIndex(model.index(model.row_of(page_no)))
+        self.on_text_found(page_no, [pymupdf.Rect(box).quad for box in model.hits[page_no].tolist()])
+        # neighbour pages with hits are rendered ahead, find next and back show them at once
+        for neighbour in (model.page_after(page_no + 1), model.page_before(page_no - 1)):
+            if neighbour is not None:
+                self.add_jump_target(neighbour)
+
+    def clear_search_highlight(self):
         if self.search_result_page != 0:
             self.pages[self.search_result_page - 1].highlight_area = None
             self.pages[self.search_result_page - 1].update_image()
             self.search_result_page = 0
-        self.search_text = text
+
+    def build_search_index(self):
+        # the index of a reloaded file is built again, pages are scanned meanwhile
+        self.searcher.index = None
+        self.index_generation += 1
+        self.searchIndexer.generation = self.index_generation
+        self.indexDocumentRequested.emit(self.index_generation, self.filename, self.doc_hash)
+
+    def on_search_index_ready(self, generation, index):
+        if generation == self.index_generation:
+            self.searcher.index = index
 
     def on_text_found(self, page_no, areas):
         self.pages[page_no - 1].highlight_area = areas
         self.search_result_page = page_no
-        if self.pages[page_no - 1].pixmap():
+        if not self.pages[page_no - 1].image.isNull():
             self.pages[page_no - 1].update_image()
-        first_result_pos = areas[0].rect.y0 / self.doc[page_no - 1].rect.height
+        first_result_pos = areas[0].rect.y0 / self.page_sizes[page_no - 1][1]
         self.jump_page(page_no, first_result_pos)
 
     # ------------------------- Translation Interface
 
     def get_word_on_mouse(self, page_no, pos):
-        zoom = self.pages[page_no - 1].height() / self.doc[page_no - 1].rect.height
-
-        active_word_count = -1
+        self.pause_pretranslation()
+        page_text = self.page_texts.get(page_no)
+        if page_text is None:
+            return
+        zoom = self.pages[page_no - 1].height() / self.page_sizes[page_no - 1][1]
 
-        for rect, count in zip(self.text_rect[page_no - 1], range(len(self.text_rect[page_no - 1]))):
-            if self.is_point_in_rect(rect, pos, zoom):
-                active_word_count = count
-                self.create_word_popup_location(rect, pos, zoom)
-                break
+        active_word_count = page_text.word_at(pos.x() / zoom, pos.y() / zoom)
+        if active_word_count != -1:
+            self.create_word_popup_location(page_text.word(active_word_count), pos, zoom)
 
         if self.active_word["page"] == page_no and self.active_word["count"] == active_word_count:
+            self.hoverTimer.stop()
+            self.hovered_word = None
             return
 
         elif active_word_count != -1:
-            self.active_word["page"] = page_no
-            self.active_word["count"] = active_word_count
-            t = self.translator.translate_word(page_no, self.text_translated[page_no - 1][active_word_count])
-
-            self.build_popup(t, "window")
+            if self.hovered_word != (page_no, active_word_count):
+                self.hovered_word = (page_no, active_word_count)
+                self.hoverTimer.start(HOVER_DWELL_MS)
 
         else:
-            try:
-                self.kill_popup()
-                self.active_word["page"] = None
-                self.active_word["count"] = None
-            except:
-                pass
-
-    def is_point_in_rect(self, rect, pos, zoom):
-        if pos.x() / zoom >= rect[0]:
-            if pos.y() / zoom >= rect[1]:
-                if pos.x() / zoom <= rect[2]:
-                    if pos.y() / zoom <= rect[3]:
-                        return True
-        return False
+            self.hoverTimer.stop()
+            self.hovered_word = None
+            self.kill_popup()
+            self.active_word["page"] = None
+            self.active_word["count"] = None
+
+    def on_hover_dwell(self):
+        if self.hovered_word is None:
+            return
+        page_no, active_word_count = self.hovered_word
+        self.hovered_word = None
+        page_text = self.page_texts.get(page_no)
+        if page_text is None or active_word_count >= len(page_text):
+            return
+        self.active_word["page"] = page_no
+        self.active_word["count"] = active_word_count
+        t = self.translator.translate_word(page_no, page_text.word_string(active_word_count))
+
+        self.build_popup(t, "window")
 
     def create_word_popup_location(self, rect, pos, zoom):
         mouse_x = pos.x() / zoom
@@ -653,38 +1509,37 @@ class Window(QMainWindow, Ui_window):
         self.popup_move_y = int(
             (mouse_y - (rect[1] - ((rect[3] - rect[1]) + QFontInfo(QFont("times", 1)).pointSize()))) ) * zoom
 
-    def clac_select_line_text(self, page_no, first_pos, last_pos, img, rect_zoom):
-        zoom = self.pages[page_no - 1].height() / self.doc[page_no - 1].rect.height
-        if last_pos.y() < first_pos.y():
-            upper_pos = last_pos / zoom
-            lower_pos = first_pos / zoom
-        else:
-            upper_pos = first_pos / zoom
-            lower_pos = last_pos / zoom
-
-        text_page = self.doc[page_no - 1].get_textpage()
-        text = text_page.extractSelection(pointa=(upper_pos.x(), upper_pos.y()), pointb=(lower_pos.x(), lower_pos.y()))
+    def clac_select_line_text(self, page_no, first_pos, last_pos, rect_zoom):
+        page_text = self.page_texts.get(page_no)
+        if page_text is None:
+            return
+        # selected text is made of the same words as the highlighted selection
+        xyCut = XYcut(page_text=page_text, first_pos=first_pos, last_pos=last_pos, zoom=rect_zoom)
+        counts = xyCut.get_word_counts()
+        text = page_text.words_text([page_text.word(count) for count in counts])
+        # the translation of the selection is stored by the offset of its first word
+        self.selection_key = (page_no, int(page_text.spans[counts[0], 0])) if counts else None
+        self.selection_sentences = page_text.sentences_of(counts)
 
         self.selection_translated = text
         self.selection_text = text.replace("\n", '')
         
 
-    def select_line(self, page_no, pos, first_pos, img, rect_zoom):
-        zoom = self.pages[page_no - 1].height() / self.doc[page_no - 1].rect.height
-        self.painter = QPainter(img)
+    def select_line(self, page_no, pos, first_pos, rect_zoom):
+        self.pause_pretranslation()
+        page_text = self.page_texts.get(page_no)
+        if page_text is None:
+            return
+        zoom = self.pages[page_no - 1].height() / self.page_sizes[page_no - 1][1]
 
-        xyCut = XYcut(doc=self.doc, page_no=page_no, first_pos=first_pos, last_pos=pos, zoom=rect_zoom, img=img)
+        xyCut = XYcut(page_text=page_text, first_pos=first_pos, last_pos=pos, zoom=rect_zoom)
         text_cordinat_list: List[WORD] = xyCut.get_text_in_rect()
-        for text_cordinat in text_cordinat_list:
-            self.painter.fillRect(int(text_cordinat.x0 * zoom),
-                                  int(text_cordinat.y0 * zoom),
-                                  int((text_cordinat.x1 - text_cordinat.x0) *zoom),
-                                  int((text_cordinat.y1 - text_cordinat.y0) *zoom),
-                                  QColor(100, 100, 100, 100))
+        self.selection_text_cordinat = text_cordinat_list
+        # the selection is drawn by the page widget over its image
+        self.pages[page_no - 1].set_selection(text_cordinat_list)
+        self.selection_page = page_no
 
         self.create_selected_line_popup_location(self.selection_text_cordinat, pos, zoom)
-        self.painter.end()
-        self.pages[page_no - 1].setPixmap(img)
 
     def create_selected_line_popup_location(self, rects, pos, zoom):
         if not rects:
@@ -703,18 +1558,19 @@ class Window(QMainWindow, Ui_window):
         self.popup_move_x = int((min_x_in_line - mouse_x) * zoom)
         self.popup_move_y = int((max_y_in_line - mouse_y) * zoom)
 
-    def unselect_line(self, page_no, img):
-        self.painter = QPainter(img)
-        self.pages[page_no - 1].setPixmap(img)
-        self.painter.end()
+    def unselect_line(self, page_no):
+        if 0 < self.selection_page <= len(self.pages):
+            self.pages[self.selection_page - 1].set_selection([])
+        self.selection_page = 0
         self.selection_text = ""
         self.selection_translated = ""
-        self.selection_text_cordinat.clear()
+        self.selection_text_cordinat = []
 
     def send_selection_to_translate(self):
         if self.selection_translated == "":
             return
-        worker = Worker(self.translator.translate_selection, self.selection_translated)
+        worker = Worker(self.translator.translate_selection, self.selection_translated, self.selection_key,
+                        self.selection_sentences)
         self.threadPool.start(worker)
 
     def show_selection(self):
@@ -723,12 +1579,19 @@ class Window(QMainWindow, Ui_window):
     def build_popup(self, name, win_type):
         geometry = {"x": QCursor().pos().x() + self.popup_move_x,
                     "y": QCursor().pos().y() + self.popup_move_y}
-        self.popup = Popup(name, win_type, geometry)
+        # one popup of each type is created, then its text and position are changed in place
+        self.popup = self.popups.get(win_type)
+        if self.popup is None:
+            self.popup = Popup(name, win_type, geometry)
+            self.popups[win_type] = self.popup
+        else:
+            self.popup.set_text(name, geometry)
         self.popup.adjustSize()
         self.popup.show()
 
     def kill_popup(self):
-        self.popup.close()
+        if "window" in self.popups:
+            self.popups["window"].hide()
 
 
     # ------------------------- Outlines TODO
@@ -740,39 +1603,178 @@ class Window(QMainWindow, Ui_window):
             self.dockWidget.hide()
         self.dock_widget_status = not self.dock_widget_status
 
-    def get_outlines(self, doc):
-        outlines = doc.get_toc()
+    def get_outlines(self, outlines):
+        # the model of the previous document or file version is replaced
+        old_model = self.treeView.model()
+        self.treeView.setModel(OutlineModel(outlines, self) if outlines else None)
+        if old_model is not None:
+            old_model.deleteLater()
         if not outlines:
             return
-
-        outline_model = QStandardItemModel(self)
-        parent_item = outline_model.invisibleRootItem()
-        q_item_dict = {
-            "0": parent_item
-        }
-        for item in outlines:
-            level, title, page_number = item
-            item = QStandardItem(title)
-
-            item.setData(page_number, QtCore.Qt.UserRole + 1)
-            item.setData(0, QtCore.Qt.UserRole + 2)
-            page_item = item.clone()
-            page_item.setText(str(page_number))
-            page_item.setTextAlignment(QtCore.Qt.AlignRight)
-            q_item_dict[str(level - 1)].appendRow([item, page_item])
-            q_item_dict[str(level)] = item
-
-        self.treeView.setModel(outline_model)
         self.treeView.setHeaderHidden(True)
         self.treeView.header().setSectionResizeMode(0, 1)
         self.treeView.header().setStretchLastSection(False)
 
+    def on_outline_hover(self, m_index):
+        # prefetch the page of the hovered outline entry
+        page_num = self.treeView.model().data(m_index, PAGE_ROLE)
+        if page_num and 1 <= page_num <= self.pages_count:
+            self.add_jump_target(page_num)
+
     def on_outline_click(self, m_index):
-        page_num = self.treeView.model().data(m_index, QtCore.Qt.UserRole + 1)
-        top = self.treeView.model().data(m_index, QtCore.Qt.UserRole + 2)
+        page_num = self.treeView.model().data(m_index, PAGE_ROLE)
+        top = self.treeView.model().data(m_index, TOP_ROLE)
         if not page_num: return
         self.jump_page(page_num, top)
 
+    # ------------------------- Thumbnails
+
+    def dock_thumbnails_open_hide(self):
+        if not self.dock_thumbnails_status:
+            self.dockThumbnails.show()
+            self.thumbnailView.set_current_page(self.current_page)
+        else:
+            self.dockThumbnails.hide()
+        self.dock_thumbnails_status = not self.dock_thumbnails_status
+
+    def request_thumbnails(self, generation, pages, emit_count):
+        self.thumbnailRenderer.generation = generation  # stops the running batch
+        self.thumbnailBatchRequested.emit(generation, pages, emit_count)
+
+    def on_thumbnail_ready(self, page_no, image):
+        model = self.thumbnailView.model()
+        if model is not None and page_no <= model.pages_count:
+            model.set_thumbnail(page_no, image)
+
+    # ------------------------- Reflow
+
+    def reflow_open_hide(self):
+        if not self.pages:
+            return
+        if not self.reflow_status:
+            self.scrollArea.hide()
+            self.reflowView.show()
+            self.reflowView.show_page(self.current_page)
+        else:
+            page_no = self.reflowView.top_page()
+            self.reflowView.hide()
+            self.scrollArea.show()
+            if page_no:
+                self.jump_page(page_no)
+        self.reflow_status = not self.reflow_status
+
+    def page_blocks(self, page_no):
+        """ Text blocks of a page for the reflow view, text of rendered pages is reused """
+        if page_no in self.page_texts:
+            return self.page_texts[page_no].block_texts()
+        if self.doc is not None:
+            # not kept, reflowing a long document would hold the text of every page
+            return PageText(self.doc[page_no - 1]).block_texts()
+        return None
+
+    def is_translation_wanted(self, page_no):
+        """ Called from the translator thread, pages shown in reflow mode or near the screen
+            in overlay mode are translated """
+        if self.reflow_status and page_no in self.reflowView.visible_pages:
+            return True
+        return self.overlay_status and page_no in self.prefetch_window
+
+    def on_blocks_translated(self, page_no, blocks, translations):
+        model = self.reflowView.model()
+        if model is not None and page_no <= model.pages_count:
+            model.set_translations(page_no, blocks, translations)
+        self.overlay_translating.discard(page_no)
+        if translations and page_no <= self.pages_count:
+            self.page_translations[page_no] = (blocks, translations)
+            if self.overlay_status:
+                self.request_overlay(page_no)
+
+    # ------------------------- Translated Overlay
+
+    def overlay_open_hide(self):
+        # Draws the translation of each text block over the page
+        if not self.pages:
+            return
+        self.overlay_status = not self.overlay_status
+        for page_no in self.rendered_pages:
+            if self.overlay_status:
+                self.request_overlay(page_no)
+            else:
+                self.pages[page_no - 1].set_overlay(QImage())
+
+    def request_overlay(self, page_no):
+        page = self.pages[page_no - 1]
+        if page.image.isNull() or page.is_draft or not page.overlay_image.isNull():
+            return
+        image = self.overlay_pages.get((page_no, MODEL_NAME), page.image_dpi)
+        if image is not None:
+            page.set_overlay(image)
+            return
+        page_text = self.page_texts.get(page_no)
+        if page_text is None:
+            return
+        text_blocks = page_text.text_blocks()
+        blocks = list(text_blocks.values())
+        if self.page_translations.get(page_no, (None,))[0] != blocks:
+            if blocks and page_no not in self.overlay_translating:
+                self.overlay_translating.add(page_no)
+                self.blocksTranslationRequested.emit(page_no, blocks)
+            return
+        translations = self.page_translations[page_no][1]
+        rects = [tuple(page_text.blocks[block_no]) if block_no in page_text.blocks else (0, 0, 0, 0)
+                 for block_no in text_blocks]
+        worker = Worker(self.compose_page_overlay, page_no, page.image_dpi, page.image,
+                        list(zip(rects, translations)))
+        self.overlayPool.start(worker)
+
+    def compose_page_overlay(self, page_no, dpi, image, blocks):
+        """ Runs in the overlay pool """
+        overlay = compose_overlay(image, dpi, blocks)
+        self.overlay_pages.put((page_no, MODEL_NAME), dpi, overlay)
+        self.overlayReady.emit(page_no, dpi, overlay)
+
+    def on_overlay_ready(self, page_no, dpi, image):
+        if not self.overlay_status or page_no > len(self.pages):
+            return
+        page = self.pages[page_no - 1]
+        if page.image_dpi == dpi and not page.image.isNull() and not page.is_draft:
+            page.set_overlay(image)
+
+    # ------------------------- Background Translation
+
+    def pretranslate_on_off(self):
+        # Translates sentences of all pages into the translation store, from the current page outwards
+        self.pretranslate_status = not self.pretranslate_status
+        self.pretranslateAction.setChecked(self.pretranslate_status)
+        if self.pretranslate_status:
+            self.start_pretranslation()
+        else:
+            self.stop_pretranslation()
+
+    def start_pretranslation(self):
+        if not self.pretranslate_status or self.pages_count == 0:
+            return
+        self.stop_pretranslation()
+        self.pretranslated_pages = 0
+        self.pretranslator.center_page = self.current_page
+        self.pretranslateRequested.emit(self.pretranslate_generation)
+
+    def stop_pretranslation(self):
+        # the worker also waits for this before it opens another document
+        self.pretranslate_generation += 1
+        self.pretranslator.generation = self.pretranslate_generation
+
+    def pause_pretranslation(self):
+        """ The model is left to the user while scrolling, hovering and selecting """
+        self.pretranslator.paused_until = time.monotonic() + PRETRANSLATE_IDLE_SEC
+
+    def on_page_pretranslated(self, generation, page_no):
+        if generation != self.pretranslate_generation:
+            return
+        self.pretranslated_pages += 1
+        self.pretranslateAction.setToolTip(
+            f"Translate in Background ({self.pretranslated_pages} / {self.pages_count} pages)")
+
     # ------------------------- Other Functions
 
     def copy_text(self):
@@ -807,6 +1809,8 @@ class Window(QMainWindow, Ui_window):
 
     def closeEvent(self, ev):
         """ Save all settings on window close """
+        for popup in self.popups.values():
+            popup.close()
         return QMainWindow.closeEvent(self, ev)
         # # self.save_file_data()
         # self.settings.setValue("OffsetX", self.geometry().x() - self.x())
@@ -818,9 +1822,22 @@ class Window(QMainWindow, Ui_window):
         # return QMainWindow.closeEvent(self, ev)
 
     def on_quit(self):
-        self.thread1.quit()
-        self.thread2.quit()
+        if self.renderPool:
+            self.renderPool.shutdown()
+        else:
+            self.thread1.quit()
+            self.thread2.quit()
         self.thread3.quit()
+        self.thumbnailRenderer.generation = -1
+        self.thread4.quit()
+        self.documentLoader.generation = -1
+        self.thread5.quit()
+        self.searchIndexer.generation = -1
+        self.thread6.quit()
+        self.searcher.generation = -1
+        self.thread7.quit()
+        self.pretranslator.generation = -1
+        self.thread8.quit()
         
         return QMainWindow.closeEvent(self, QCloseEvent())
 
@@ -830,9 +1847,9 @@ class Frame(QFrame):
         Window through this widget """
     jumpToRequested = QtCore.pyqtSignal(int, float)
     getWordOnMouseRequested = QtCore.pyqtSignal(int, QtCore.QPoint)
-    selectLineRequested = QtCore.pyqtSignal(int, QtCore.QPoint, QtCore.QPoint, QPixmap, float)
-    unselectLineRequest = QtCore.pyqtSignal(int, QPixmap)
-    calcSelectLineRequested = QtCore.pyqtSignal(int, QtCore.QPoint, QtCore.QPoint, QPixmap, float)
+    selectLineRequested = QtCore.pyqtSignal(int, QtCore.QPoint, QtCore.QPoint, float)
+    unselectLineRequest = QtCore.pyqtSignal(int)
+    calcSelectLineRequested = QtCore.pyqtSignal(int, QtCore.QPoint, QtCore.QPoint, float)
     sendSelectionToTranslateRequest = QtCore.pyqtSignal()
     showStatusRequested = QtCore.pyqtSignal(str)
 
@@ -849,14 +1866,14 @@ class Frame(QFrame):
         debug(pos)
         self.getWordOnMouseRequested.emit(page_num, pos)
 
-    def select_line(self, page_num, pos, first_pos, img, rect_zoom):
-        self.selectLineRequested.emit(page_num, pos, first_pos, img, rect_zoom)
+    def select_line(self, page_num, pos, first_pos, rect_zoom):
+        self.selectLineRequested.emit(page_num, pos, first_pos, rect_zoom)
 
-    def calc_select_line(self, page_num, first_pos, last_pos, img, rect_zoom):
-        self.calcSelectLineRequested.emit(page_num, first_pos, last_pos, img, rect_zoom)
+    def calc_select_line(self, page_num, first_pos, last_pos, rect_zoom):
+        self.calcSelectLineRequested.emit(page_num, first_pos, last_pos, rect_zoom)
 
-    def unselect_line(self, page_no, img):
-        self.unselectLineRequest.emit(page_no, img)
+    def unselect_line(self, page_no):
+        self.unselectLineRequest.emit(page_no)
 
     def send_selection_to_translate(self):
         self.sendSelectionToTranslateRequest.emit()
@@ -877,24 +1894,80 @@ class PageWidget(QLabel):
         self.link_annots = []
         self.annots_listed = False
         self.highlight_area = None
+        self.selection_words = []
         self.page_num = page_num
-        self.image = QPixmap()
+        self.image = QImage()  # grayscale pages keep their 8 bit format
+        self.overlay_image = QImage()  # the image with translations drawn over it, shown instead of image
+        self.image_dpi = 0
+        self.requested_dpi = 0
+        self.requested_draft = False  # quality of the last request, the image shown may be older
+        self.is_draft = False
         self.selectMode = False
         self.mousePressPos = None
 
-    def set_page_data(self, page_no, pixmap, page):
-        self.image = pixmap
+    def set_page_data(self, page_no, image):
+        self.image = image
+        self.overlay_image = QImage()
+        self.update_image()
+
+    def set_overlay(self, image):
+        self.overlay_image = image
         self.update_image()
 
     def clear(self):
         QLabel.clear(self)
-        self.image = QPixmap()
+        self.image = QImage()
+        self.overlay_image = QImage()
+        self.image_dpi = 0
+        self.requested_dpi = 0
+        self.requested_draft = False
+        self.is_draft = False
+
+    def image_fits(self):
+        # rendered size may differ from the widget size by rounding
+        return abs(self.image.width() - self.width()) <= 2 and abs(self.image.height() - self.height()) <= 2
+
+    def word_box(self, word):
+        zoom = self.dpi / 72.0
+        return QtCore.QRect(int(word.x0 * zoom), int(word.y0 * zoom),
+                            int((word.x1 - word.x0) * zoom), int((word.y1 - word.y0) * zoom))
+
+    def set_selection(self, words: List[WORD]):
+        """ Only the boxes of words that enter or leave the selection are repainted """
+        changed = set(self.selection_words).symmetric_difference(words)
+        self.selection_words = words
+        if changed:
+            region = QRegion()
+            for word in changed:
+                region += self.word_box(word)
+            self.update(region)
+
+    def paintEvent(self, ev):
+        # the page image is painted directly, search highlights and the selection are drawn over it
+        if self.image.isNull():
+            return
+        painter = QPainter(self)
+        image = self.image if self.overlay_image.isNull() else self.overlay_image
+        if self.image_fits():
+            painter.drawImage(ev.rect(), image, ev.rect())
+        else:
+            painter.drawImage(self.rect(), image)
+        if self.highlight_area:
+            zoom = self.dpi / 72.0
+            for area in self.highlight_area:
+                box = QtCore.QRectF(area.rect.x0 * zoom, area.rect.y0 * zoom,
+                                    area.rect.width * zoom, area.rect.height * zoom)
+                painter.fillRect(box, QColor(0, 255, 0, 127))
+        for word in self.selection_words:
+            box = self.word_box(word)
+            if box.intersects(ev.rect()):
+                painter.fillRect(box, QColor(100, 100, 100, 100))
+        painter.end()
 
     def mouseMoveEvent(self, ev):
         if self.selectMode:
-            img = self.image.copy()
             rect_zoom = self.dpi / 72.0
-            self.manager.select_line(self.page_num, ev.pos(), self.mousePressPos, img, rect_zoom)
+            self.manager.select_line(self.page_num, ev.pos(), self.mousePressPos, rect_zoom)
 
         else:
             self.manager.get_word_on_mouse(self.page_num, ev.pos())
@@ -903,16 +1976,15 @@ class PageWidget(QLabel):
         ev.ignore()  # pass to underlying frame if not over link or copy text mode
 
     def mousePressEvent(self, ev):
-        self.manager.unselect_line(self.page_num, self.image.copy())
+        self.manager.unselect_line(self.page_num)
         self.selectMode = True
         self.mousePressPos = ev.pos()
         ev.ignore()
 
     def mouseReleaseEvent(self, ev):
         if self.selectMode:
-            img = self.image.copy()
             rect_zoom = self.dpi / 72.0
-            self.manager.calc_select_line(self.page_num, self.mousePressPos, ev.pos(), img, rect_zoom)
+            self.manager.calc_select_line(self.page_num, self.mousePressPos, ev.pos(), rect_zoom)
 
         self.selectMode = False
         self.mousePressPos = None
@@ -920,19 +1992,8 @@ class PageWidget(QLabel):
         ev.ignore()
 
     def update_image(self):
-        """ repaint page widget, and draw highlight areas """
-        if self.highlight_area:
-            img = self.image.copy()
-            painter = QPainter(img)
-            zoom = self.dpi / 72.0
-            for area in self.highlight_area:
-                box = QtCore.QRectF(area.rect.x0 * zoom, area.rect.y0 * zoom,
-                                    area.rect.width * zoom, area.rect.height * zoom)
-                painter.fillRect(box, QColor(0, 255, 0, 127))
-            painter.end()
-            self.setPixmap(img)
-        else:
-            self.setPixmap(self.image)
+        """ repaint page widget with its highlight areas """
+        self.update()
 
 
 class Popup(QWidget):
@@ -952,11 +2013,11 @@ class Popup(QWidget):
             self.setWindowFlags(PyQt5.QtCore.Qt.Popup)
         self.setGeometry(int(win_pos["x"]), int(win_pos["y"]), 0, 0)
 
-
-def wait(millisecond):
-    loop = QtCore.QEventLoop()
-    QtCore.QTimer.singleShot(millisecond, loop.quit)
-    loop.exec_()
+    def set_text(self, name, win_pos):
+        self.name = name
+        self.lbl.setText(self.name)
+        self.lbl.adjustSize()
+        self.move(int(win_pos["x"]), int(win_pos["y"]))
 
 
 def collapse_user(path):
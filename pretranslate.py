@@ -0,0 +1,90 @@
+import sqlite3
+import time
+from typing import Callable, List, Optional, Set
+
+import pymupdf
+from PyQt5 import QtCore
+
+from text_model import PageText
+from translation_store import TranslationStore, SENTENCE
+
+# sentences sent to the model at a time, the user is checked for between batches
+PRETRANSLATE_BATCH = 16
+# translation pauses until the user has been idle this long
+PRETRANSLATE_IDLE_SEC = 1.5
+
+
+class Pretranslator(QtCore.QObject):
+    """ Translates the sentences of every page in the background and writes them into the translation
+        store, so selections of translated pages need no model call. Pages are taken outwards from
+        center_page, work pauses while the user interacts and stops when a newer run is requested """
+    pageTranslated = QtCore.pyqtSignal(int, int)  # generation, page_no
+
+    def __init__(self, translate_batch: Callable[[List[str]], List[str]], model_name: str):
+        QtCore.QObject.__init__(self)
+        self.translate_batch = translate_batch
+        self.model_name = model_name
+        self.doc = None
+        self.store: Optional[TranslationStore] = None
+        # set from the main thread
+        self.generation = 0
+        self.center_page = 1
+        self.paused_until = 0.0
+
+    def load_document(self, filename, password='', doc_hash=''):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+        try:
+            self.doc = pymupdf.open(filename)
+        except Exception as e:
+            # the file may be rewritten meanwhile, the reload after the next change opens it again
+            print(f"Pretranslator can not open {filename}: {e}")
+            return
+        try:
+            self.store = TranslationStore.open_document(doc_hash)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Can not open the translation store of {filename}: {e}")
+            self.store = None
+
+    def run(self, generation):
+        if self.doc is None or self.store is None:
+            return
+        done = set()
+        while self.wait_for_idle(generation):
+            page_no = self.next_page(done)
+            if page_no is None:
+                return
+            if not self.translate_page(generation, page_no):
+                return
+            done.add(page_no)
+            self.pageTranslated.emit(generation, page_no)
+
+    def wait_for_idle(self, generation) -> bool:
+        """ Returns False if the run is cancelled while waiting """
+        while generation == self.generation and time.monotonic() < self.paused_until:
+            QtCore.QThread.msleep(100)
+        return generation == self.generation
+
+    def next_page(self, done: Set[int]) -> Optional[int]:
+        pages_count = len(self.doc)
+        center = min(max(self.center_page, 1), pages_count)
+        for distance in range(pages_count):
+            for page_no in (center + distance, center - distance):
+                if 1 <= page_no <= pages_count and page_no not in done:
+                    return page_no
+        return None
+
+    def translate_page(self, generation, page_no) -> bool:
+        """ Translates sentences of the page that are not in the store yet """
+        sentences = PageText(self.doc[page_no - 1]).sentence_texts()
+        stored = self.store.get_texts(self.model_name, SENTENCE, page_no, sentences)
+        missing = [(start, text) for start, text in sentences if start not in stored]
+        for first in range(0, len(missing), PRETRANSLATE_BATCH):
+            if not self.wait_for_idle(generation):
+                return False
+            batch = missing[first:first + PRETRANSLATE_BATCH]
+            translations = self.translate_batch([text for _, text in batch])
+            self.store.put_texts(self.model_name, SENTENCE, page_no,
+                                 [(start, text, translation) for (start, text), translation in zip(batch, translations)])
+        return True
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+
+# pages whose text blocks are kept in memory, the others show a one line placeholder
+REFLOW_PAGE_LIMIT = 300
+
+
+class ReflowModel(QtCore.QAbstractListModel):
+    """ One row per page holding the text blocks of the page, each followed by its translation.
+        Rows are filled only when they are shown, so a row costs a few bytes until then.
+        page_blocks returns the blocks of a page, or None if the text is not available yet """
+    translationsRequested = QtCore.pyqtSignal(int, list)
+
+    def __init__(self, pages_count, page_blocks: Callable[[int], Optional[List[str]]], parent=None):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.pages_count = pages_count
+        self.page_blocks = page_blocks
+        self.blocks = OrderedDict()  # page_no: list of block texts
+        self.translations = {}  # page_no: list of block translations
+        self.translating = set()  # pages sent to the translator
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.pages_count
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        page_no = index.row() + 1
+        if role == QtCore.Qt.DisplayRole:
+            if page_no not in self.blocks:
+                return f"— {page_no} —"
+            translations = self.translations.get(page_no, [])
+            text = [f"— {page_no} —"]
+            for count, block in enumerate(self.blocks[page_no]):
+                text.append(block)
+                if count < len(translations):
+                    text.append("» " + translations[count])
+            return "\n\n".join(text)
+        return None
+
+    def is_loaded(self, page_no):
+        return page_no in self.blocks
+
+    def load_pages(self, pages: List[int]) -> bool:
+        """ Fills rows of the given pages, returns True if a row has changed """
+        changed = False
+        for page_no in pages:
+            if page_no in self.blocks:
+                self.blocks.move_to_end(page_no)
+            else:
+                blocks = self.page_blocks(page_no)
+                if blocks is None:
+                    continue
+                self.blocks[page_no] = blocks
+                self.emit_changed(page_no)
+                changed = True
+            if self.blocks[page_no] and page_no not in self.translations and page_no not in self.translating:
+                self.translating.add(page_no)
+                self.translationsRequested.emit(page_no, self.blocks[page_no])
+        while len(self.blocks) > REFLOW_PAGE_LIMIT:
+            old_page_no, _ = self.blocks.popitem(last=False)
+            self.emit_changed(old_page_no)
+        return changed
+
+    def set_translations(self, page_no, blocks, translations):
+        """ An empty list means the page was scrolled away before it was translated """
+        self.translating.discard(page_no)
+        # translations of blocks that changed while they were being translated are dropped
+        if not translations or self.blocks.get(page_no) != blocks:
+            return
+        self.translations[page_no] = translations
+        self.emit_changed(page_no)
+
+    def remove_page(self, page_no):
+        self.translations.pop(page_no, None)
+        if self.blocks.pop(page_no, None) is not None:
+            self.emit_changed(page_no)
+
+    def set_pages_count(self, pages_count):
+        if pages_count > self.pages_count:
+            self.beginInsertRows(QtCore.QModelIndex(), self.pages_count, pages_count - 1)
+            self.pages_count = pages_count
+            self.endInsertRows()
+        elif pages_count < self.pages_count:
+            self.beginRemoveRows(QtCore.QModelIndex(), pages_count, self.pages_count - 1)
+            for page_no in range(pages_count + 1, self.pages_count + 1):
+                self.blocks.pop(page_no, None)
+                self.translations.pop(page_no, None)
+            self.pages_count = pages_count
+            self.endRemoveRows()
+
+    def emit_changed(self, page_no):
+        index = self.index(page_no - 1)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole])
+
+
+class ReflowView(QListView):
+    """ Shows the text of the document without rendering pages. Rows on the screen
+        and the row below them are filled after scrolling stops """
+
+    def __init__(self, parent=None):
+        QListView.__init__(self, parent)
+        self.setWordWrap(True)
+        self.setUniformItemSizes(False)
+        self.setResizeMode(QListView.Adjust)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setSpacing(8)
+        self.visible_pages = set()  # read by the translator thread
+        self.requestTimer = QtCore.QTimer(self)
+        self.requestTimer.setSingleShot(True)
+        self.requestTimer.timeout.connect(self.load_visible_pages)
+        self.verticalScrollBar().valueChanged.connect(lambda value: self.requestTimer.start(50))
+
+    def resizeEvent(self, ev):
+        QListView.resizeEvent(self, ev)
+        self.requestTimer.start(50)
+
+    def showEvent(self, ev):
+        QListView.showEvent(self, ev)
+        self.requestTimer.start(50)
+
+    def top_page(self):
+        row = self.first_visible_row()
+        return row + 1 if row != -1 else 0
+
+    def first_visible_row(self):
+        # the point may fall into the spacing between rows
+        for y in range(1, 2 * self.spacing() + 2, self.spacing()):
+            row = self.indexAt(QtCore.QPoint(self.viewport().width() // 2, y)).row()
+            if row != -1:
+                return row
+        return -1
+
+    def load_visible_pages(self):
+        model: ReflowModel = self.model()
+        if model is None or not self.isVisible() or model.pages_count == 0:
+            return
+        first = max(self.first_visible_row(), 0)
+        last = first
+        while last + 1 < model.pages_count and \
+                self.visualRect(model.index(last + 1)).top() < self.viewport().height():
+            last += 1
+        # the row above is not filled, it would push the rows on the screen down
+        pages = list(range(first + 1, min(last + 2, model.pages_count) + 1))
+        self.visible_pages = set(pages)
+        # filled rows get taller and push the rows below out of the screen, others may come in
+        if model.load_pages(pages):
+            self.requestTimer.start(0)
+
+    def show_page(self, page_no):
+        model = self.model()
+        if model is None or not 1 <= page_no <= model.pages_count:
+            return
+        self.scrollTo(model.index(page_no - 1), QAbstractItemView.PositionAtTop)
+        self.requestTimer.start(0)
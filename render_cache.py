@@ -0,0 +1,177 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy
+import pymupdf
+from PyQt5.QtGui import QImage
+
+DISPLAY_LIST_CACHE_BYTES = 64 * 1024 * 1024
+COMPRESSED_CACHE_BYTES = 96 * 1024 * 1024
+FULL_AA_LEVEL = 8
+DRAFT_AA_LEVEL = 2
+
+# anti-aliasing level is a global MuPDF setting, renderer threads of a process take turns
+aa_lock = threading.Lock()
+
+# color modes: "color" renders RGB, "gray" renders every page in 8 bit grayscale,
+# "auto" renders pages in grayscale after they are found to have no colors
+COLOR_MODES = ("color", "gray", "auto")
+# components per pixel of the image color spaces reported by get_images, ICC based spaces are looked up
+IMAGE_COMPONENTS = {"DeviceGray": 1, "CalGray": 1, "Indexed": 1, "Separation": 1,
+                    "DeviceRGB": 3, "CalRGB": 3, "Lab": 3, "DeviceCMYK": 4}
+ICC_PROFILE = re.compile(r"/ICCBased\s+(\d+)\s+0\s+R")
+
+
+def qimage_format(n_channels: int) -> QImage.Format:
+    if n_channels == 1:
+        return QImage.Format.Format_Grayscale8
+    if n_channels == 4:
+        return QImage.Format.Format_RGBA8888
+    return QImage.Format.Format_RGB888
+
+
+def image_components(doc: pymupdf.Document, xref: int, colorspace: str) -> int:
+    """ Components per pixel of an image, images whose color space is not known count as RGB """
+    if colorspace in IMAGE_COMPONENTS:
+        return IMAGE_COMPONENTS[colorspace]
+    if colorspace == "ICCBased":
+        kind, value = doc.xref_get_key(xref, "ColorSpace")
+        if kind == "xref":
+            value = doc.xref_object(int(value.split()[0]), compressed=True)
+        profile = ICC_PROFILE.search(value)
+        if profile:
+            kind, count = doc.xref_get_key(int(profile.group(1)), "N")
+            if kind == "int":
+                return int(count)
+    return 3
+
+
+def is_grayscale(pix: pymupdf.Pixmap, tolerance: int = 8) -> bool:
+    """ Checks every fourth pixel in both directions for a difference between color channels """
+    if pix.n < 3:
+        return True
+    samples = numpy.frombuffer(pix.samples_mv, dtype=numpy.uint8).reshape(pix.height, pix.stride)
+    pixels = samples[::4, :pix.width * pix.n].reshape(-1, pix.width, pix.n)[:, ::4, :3].astype(numpy.int16)
+    return bool(numpy.abs(pixels[..., 0] - pixels[..., 1]).max(initial=0) <= tolerance and
+                numpy.abs(pixels[..., 1] - pixels[..., 2]).max(initial=0) <= tolerance)
+
+
+class DisplayListCache():
+    """ Keeps MuPDF display lists of visited pages. Rendering a page again at another dpi
+        replays its display list instead of interpreting the page content stream again.
+        Least recently used lists are dropped when the estimated size exceeds max_bytes """
+
+    def __init__(self, doc: pymupdf.Document, color_mode: str = "color", max_bytes: int = DISPLAY_LIST_CACHE_BYTES):
+        self.doc = doc
+        self.color_mode = color_mode
+        self.gray_pages = set()  # pages found to be grayscale in auto color mode
+        self.max_bytes = max_bytes
+        self.lists = OrderedDict()  # page_no: (display list, estimated size)
+        self.size = 0
+
+    def get(self, page_no: int) -> pymupdf.DisplayList:
+        if page_no in self.lists:
+            self.lists.move_to_end(page_no)
+            return self.lists[page_no][0]
+        page = self.doc[page_no - 1]
+        display_list = page.get_displaylist()
+        size = self.estimate_size(page)
+        self.lists[page_no] = (display_list, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.lists) > 1:
+            _, (_, old_size) = self.lists.popitem(last=False)
+            self.size -= old_size
+        return display_list
+
+    def get_pixmap(self, page_no: int, dpi: float, colorspace: pymupdf.Colorspace = pymupdf.csRGB) -> pymupdf.Pixmap:
+        # fractional dpi of fit width, the image has the size of the page widget
+        zoom = dpi / 72.0
+        return self.get(page_no).get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+
+    def render(self, page_no: int, dpi: float, draft: bool = False) -> pymupdf.Pixmap:
+        """ Draft renders are used while scrolling fast, they have a low anti-aliasing level
+            and skip annotations. A page is not parsed into a display list for a draft """
+        # pages found to be grayscale are remembered when the mode changes
+        gray = self.color_mode == "gray" or (self.color_mode == "auto" and page_no in self.gray_pages)
+        colorspace = pymupdf.csGRAY if gray else pymupdf.csRGB
+        with aa_lock:
+            if not draft:
+                pymupdf.TOOLS.set_aa_level(FULL_AA_LEVEL)
+                pix = self.get_pixmap(page_no, dpi, colorspace)
+            else:
+                pymupdf.TOOLS.set_aa_level(DRAFT_AA_LEVEL)
+                if page_no in self.lists:
+                    pix = self.get_pixmap(page_no, dpi, colorspace)
+                else:
+                    pix = self.doc[page_no - 1].get_pixmap(matrix=pymupdf.Matrix(dpi / 72.0, dpi / 72.0),
+                                                             colorspace=colorspace, annots=False)
+        if self.color_mode == "auto" and not gray and is_grayscale(pix):
+            self.gray_pages.add(page_no)
+            pix = pymupdf.Pixmap(pymupdf.csGRAY, pix)
+        return pix
+
+    def estimate_size(self, page: pymupdf.Page) -> int:
+        # MuPDF does not report the size of a display list, content stream length
+        # and decoded image sizes are a rough measure of what the list holds
+        size = len(page.read_contents())
+        for xref, _, width, height, bpc, colorspace, *_ in page.get_images():
+            size += width * height * image_components(page.parent, xref, colorspace) * max(bpc, 1) // 8
+        return size
+
+    def clear(self):
+        self.lists.clear()
+        self.size = 0
+
+
+class CompressedImageCache():
+    """ Second tier of the page image cache. Images of pages that fall out of the rendered
+        pages are kept zlib compressed in memory, decompressing a page is much cheaper than
+        rendering it again. put() may be called from a worker thread """
+
+    def __init__(self, max_bytes: int = COMPRESSED_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()  # page_no: (dpi, width, height, bytes_per_line, format, data)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def put(self, page_no: int, dpi: float, image: QImage):
+        with self.lock:
+            if page_no in self.images and self.images[page_no][0] == dpi:
+                self.images.move_to_end(page_no)
+                return
+        # level 1 is the fastest zlib level, rendered pages are mostly flat areas and compress well anyway
+        data = zlib.compress(image.constBits().asstring(image.sizeInBytes()), 1)
+        with self.lock:
+            self.remove(page_no)
+            self.images[page_no] = (dpi, image.width(), image.height(), image.bytesPerLine(), image.format(), data)
+            self.size += len(data)
+            while self.size > self.max_bytes and self.images:
+                _, old = self.images.popitem(last=False)
+                self.size -= len(old[5])
+
+    def get(self, page_no: int, dpi: float) -> Optional[QImage]:
+        """ Returns the page image if it was stored with the same dpi """
+        with self.lock:
+            if page_no not in self.images or self.images[page_no][0] != dpi:
+                return None
+            self.images.move_to_end(page_no)
+            _, width, height, bytes_per_line, img_format, data = self.images[page_no]
+        pixels = zlib.decompress(data)
+        return QImage(pixels, width, height, bytes_per_line, img_format).copy()
+
+    def discard(self, page_no: int):
+        with self.lock:
+            self.remove(page_no)
+
+    def remove(self, page_no: int):
+        # caller holds the lock
+        if page_no in self.images:
+            self.size -= len(self.images.pop(page_no)[5])
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.size = 0
@@ -0,0 +1,235 @@
+import multiprocessing
+import os
+import queue
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import pymupdf
+from PyQt5 import QtCore
+from PyQt5.QtGui import QImage
+
+from render_cache import DisplayListCache, qimage_format
+
+# the result collector checks the workers for crashes this often while no page arrives
+WORKER_CHECK_SEC = 0.5
+# an idle worker checks this often whether the main process is still alive
+PARENT_CHECK_SEC = 2.0
+
+
+def render_worker(requests, results, worker_no, color_mode):
+    """ Entry point of a render process.
+        requests: ("open", generation, filename), ("close",), ("color", color_mode)
+        or ("render", generation, page_no, dpi, draft), None quits
+        results: (worker_no, generation, page_no, dpi, draft, shm_name, width, height, stride, n_channels) """
+    display_lists = None
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            job = requests.get(timeout=PARENT_CHECK_SEC)
+        except queue.Empty:
+            # a killed main process does not send None, the worker would wait forever
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        if job is None:
+            break
+        if job[0] == "open":
+            _, generation, filename = job
+            if display_lists is not None:
+                display_lists.doc.close()
+            try:
+                # MuPDF reads the file itself, a file rewritten in place makes reads fail instead of
+                # killing the process like a memory map of it would. Workers still share the OS page cache
+                display_lists = DisplayListCache(pymupdf.open(filename), color_mode)
+            except Exception as e:
+                print(f"Render worker {worker_no} can not open {filename}: {e}")
+                display_lists = None
+            continue
+        if job[0] == "color":
+            color_mode = job[1]
+            if display_lists is not None:
+                display_lists.color_mode = color_mode
+            continue
+        if job[0] == "close":
+            if display_lists is not None:
+                display_lists.doc.close()
+            display_lists = None
+            continue
+
+        _, generation, page_no, dpi, draft = job
+        shm_name = None
+        width = height = stride = n_channels = 0
+        try:
+            img: pymupdf.Pixmap = display_lists.render(page_no, dpi, draft)
+            samples = img.samples_mv
+            shm = shared_memory.SharedMemory(create=True, size=max(len(samples), 1))
+            shm.buf[:len(samples)] = samples
+            shm_name = shm.name
+            width, height, stride, n_channels = img.width, img.height, img.stride, img.n
+            shm.close()
+        except Exception as e:
+            print(f"Render worker {worker_no} failed on page {page_no}: {e}")
+        results.put((worker_no, generation, page_no, dpi, draft, shm_name, width, height, stride, n_channels))
+
+
+class ResultCollector(QtCore.QObject):
+    """ Waits for rendered pages of worker processes and converts them to QImage """
+    collected = QtCore.pyqtSignal(int, int, int, float, QImage, bool)
+    idle = QtCore.pyqtSignal()  # no page arrived for WORKER_CHECK_SEC
+
+    def __init__(self, results):
+        QtCore.QObject.__init__(self)
+        self.results = results
+
+    def collect(self):
+        while True:
+            try:
+                result = self.results.get(timeout=WORKER_CHECK_SEC)
+            except queue.Empty:
+                self.idle.emit()
+                continue
+            if result is None:
+                break
+            worker_no, generation, page_no, dpi, draft, shm_name, width, height, stride, n_channels = result
+            qimg = QImage()
+            if shm_name is not None:
+                shm = shared_memory.SharedMemory(name=shm_name)
+                # copy() detaches the image from the shared memory block before it is released
+                qimg = QImage(shm.buf, width, height, stride, qimage_format(n_channels)).copy()
+                shm.close()
+                shm.unlink()
+            self.collected.emit(worker_no, generation, page_no, dpi, qimg, draft)
+
+
+class RenderPool(QtCore.QObject):
+    """ Renders pages in separate processes. It has the same slots and signals as Renderer,
+        so the main window can use either of them. Pending requests wait in this object
+        until a worker is idle, a newer request for the same page replaces the older one.
+        A worker that dies is started again and its page is requested again once """
+    rendered = QtCore.pyqtSignal(int, float, QImage, bool)
+
+    def __init__(self, color_mode="color", processes=0):
+        QtCore.QObject.__init__(self)
+        if processes <= 0:
+            processes = max(1, min(4, (os.cpu_count() or 2) - 1))
+        # workers must not inherit Qt and MuPDF state of the GUI process
+        self.context = multiprocessing.get_context("spawn")
+        self.color_mode = color_mode
+        self.generation = 0
+        self.filename = None
+        # set by the main window, pending requests that are not wanted anymore are skipped
+        self.is_wanted = None
+        self.pending = OrderedDict()
+        self.results = self.context.Queue()
+        self.requests = [None] * processes
+        self.workers = [None] * processes
+        self.busy = [False] * processes
+        self.jobs = [None] * processes  # (page_no, dpi, draft) each worker is rendering
+        self.crashed_pages = set()  # pages a worker died on, they are not requested again
+        for worker_no in range(processes):
+            self.start_worker(worker_no)
+        self.collector_thread = QtCore.QThread(self)
+        self.collector = ResultCollector(self.results)
+        self.collector.moveToThread(self.collector_thread)
+        self.collector.collected.connect(self.on_collected)
+        self.collector.idle.connect(self.check_workers)
+        self.collector_thread.started.connect(self.collector.collect)
+        self.collector_thread.start()
+
+    def start_worker(self, worker_no):
+        # a new queue is used, a dead worker may have left the old one locked
+        requests = self.context.Queue()
+        worker = self.context.Process(target=render_worker,
+                                      args=(requests, self.results, worker_no, self.color_mode), daemon=True)
+        worker.start()
+        if self.filename is not None:
+            requests.put(("open", self.generation, self.filename))
+        self.requests[worker_no] = requests
+        self.workers[worker_no] = worker
+        self.busy[worker_no] = False
+        self.jobs[worker_no] = None
+
+    def check_workers(self):
+        """ Starts dead workers again, their pages go back to the front of the pending requests """
+        for worker_no, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            print(f"Render worker {worker_no} exited with code {worker.exitcode}, starting it again")
+            job = self.jobs[worker_no]
+            self.start_worker(worker_no)
+            if job is not None and job[0] not in self.pending and job[0] not in self.crashed_pages:
+                self.crashed_pages.add(job[0])
+                self.pending[job[0]] = job[1:]
+                self.pending.move_to_end(job[0], last=False)
+        self.dispatch()
+
+    def set_color_mode(self, color_mode):
+        """ setColorMode(str)
+        Requests sent from now on are rendered in the new mode, pages being rendered are dropped """
+        self.color_mode = color_mode
+        self.generation += 1
+        self.pending.clear()
+        for requests in self.requests:
+            requests.put(("color", color_mode))
+
+    def close_document(self):
+        """ closeDocument()
+        The file is being rewritten, nothing is rendered until the next load_document.
+        Pages being rendered are dropped with the old generation """
+        self.generation += 1
+        self.filename = None
+        self.pending.clear()
+        for requests in self.requests:
+            requests.put(("close",))
+
+    def load_document(self, filename, password='', doc_hash=''):
+        """ loadDocument(str)
+        Main thread uses this slot to load document in all worker processes """
+        self.generation += 1
+        self.filename = filename
+        self.pending.clear()
+        self.crashed_pages.clear()
+        for requests in self.requests:
+            requests.put(("open", self.generation, filename))
+
+    def render(self, page_no, dpi, draft=False):
+        """ render(int, float, bool)
+        Queues the page, it is sent to the first idle worker """
+        self.pending.pop(page_no, None)
+        self.pending[page_no] = (dpi, draft)
+        self.dispatch()
+
+    def dispatch(self):
+        if self.filename is None:
+            return
+        for worker_no in range(len(self.workers)):
+            if not self.workers[worker_no].is_alive():
+                self.check_workers()
+                return
+            if self.busy[worker_no]:
+                continue
+            while self.pending:
+                page_no, (dpi, draft) = self.pending.popitem(last=False)
+                if self.is_wanted is None or self.is_wanted(page_no, dpi):
+                    self.busy[worker_no] = True
+                    self.jobs[worker_no] = (page_no, dpi, draft)
+                    self.requests[worker_no].put(("render", self.generation, page_no, dpi, draft))
+                    break
+
+    def on_collected(self, worker_no, generation, page_no, dpi, image, draft):
+        self.busy[worker_no] = False
+        self.jobs[worker_no] = None
+        if generation == self.generation and not image.isNull():
+            self.rendered.emit(page_no, dpi, image, draft)
+        self.dispatch()
+
+    def shutdown(self):
+        for requests in self.requests:
+            requests.put(None)
+        for worker in self.workers:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+        self.results.put(None)
+        self.collector_thread.quit()
+        self.collector_thread.wait(1000)
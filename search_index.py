@@ -0,0 +1,252 @@
+import os
+import bisect
+from typing import Dict, List, Optional
+
+import numpy
+import pymupdf
+from PyQt5 import QtCore
+
+from doc_cache import document_cache_dir
+
+INDEX_FILE = "index.npz"
+# pages with hits sent to the main thread at a time
+SEARCH_BATCH = 20
+
+
+class SearchIndex():
+    """ Inverted index of the words of a document, words are kept lower case in extraction order.
+        tokens[i] is the vocab id of the word at position i and boxes[i] its box in points.
+        Positions of page p are page_starts[p - 1]:page_starts[p], positions of a vocab word
+        are postings[starts[id]:starts[id + 1]] """
+
+    def __init__(self, vocab: List[str], tokens: numpy.ndarray, page_starts: numpy.ndarray, boxes: numpy.ndarray):
+        self.vocab = vocab
+        self.tokens = tokens
+        self.page_starts = page_starts
+        self.boxes = boxes
+        self.word_ids = {word: count for count, word in enumerate(vocab)}
+        self.word_lengths = numpy.array([len(word) for word in vocab], dtype=numpy.int32)
+        self.postings = numpy.argsort(tokens, kind="stable").astype(numpy.int32)
+        self.starts = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(tokens, minlength=len(vocab)))))
+
+    @classmethod
+    def from_words(cls, pages_words: List[list]) -> "SearchIndex":
+        """ pages_words holds the extractWORDS result of each page """
+        word_ids = {}
+        tokens = []
+        boxes = []
+        page_starts = [0]
+        for words in pages_words:
+            for word in words:
+                tokens.append(word_ids.setdefault(word[4].lower(), len(word_ids)))
+                boxes.append(word[:4])
+            page_starts.append(len(tokens))
+        return cls(list(word_ids), numpy.array(tokens, dtype=numpy.int32),
+                   numpy.array(page_starts, dtype=numpy.int32),
+                   numpy.array(boxes, dtype=numpy.float32).reshape(-1, 4))
+
+    @classmethod
+    def load(cls, path) -> Optional["SearchIndex"]:
+        try:
+            with numpy.load(path) as data:
+                # words never contain white space, they are stored as one string
+                vocab = bytes(data["vocab"]).decode()
+                return cls(vocab.split("\n") if vocab else [], data["tokens"], data["page_starts"], data["boxes"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, path):
+        # written under another name first, a half written index is never read
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            numpy.savez(f, vocab=numpy.frombuffer("\n".join(self.vocab).encode(), dtype=numpy.uint8),
+                        tokens=self.tokens, page_starts=self.page_starts, boxes=self.boxes)
+        os.replace(temp_path, path)
+
+    def positions(self, word_ids) -> numpy.ndarray:
+        if not len(word_ids):
+            return numpy.zeros(0, dtype=numpy.int32)
+        return numpy.sort(numpy.concatenate([self.postings[self.starts[i]:self.starts[i + 1]] for i in word_ids]))
+
+    def search(self, text: str) -> Dict[int, numpy.ndarray]:
+        """ Finds text like page.search_for, ignoring case. A phrase matches words that follow each other
+            on the same page, it may start in the middle of a word and end in the middle of another.
+            Returns the boxes of the matching parts of words by page, a row x0 y0 x1 y1 per word """
+        terms = text.lower().split()
+        if not terms:
+            return {}
+        # start of the matching part in each word of the vocabulary, -1 if the word does not match
+        if len(terms) == 1:
+            firsts = [word.find(terms[0]) for word in self.vocab]
+        else:
+            firsts = [len(word) - len(terms[0]) if word.endswith(terms[0]) else -1 for word in self.vocab]
+        firsts = numpy.array(firsts, dtype=numpy.int32)
+        starts = self.positions(numpy.flatnonzero(firsts >= 0))
+        last = len(terms) - 1
+        if last > 0:
+            starts = starts[starts + last < len(self.tokens)]
+            for k, term in enumerate(terms[1:-1], 1):
+                starts = starts[self.tokens[starts + k] == self.word_ids.get(term, -1)]
+            last_ids = [count for count, word in enumerate(self.vocab) if word.startswith(terms[-1])]
+            starts = starts[numpy.isin(self.tokens[starts + last], last_ids)]
+        pages = numpy.searchsorted(self.page_starts, starts, side="right")
+        # a phrase does not continue on the next page
+        same_page = numpy.searchsorted(self.page_starts, starts + last, side="right") == pages
+        starts, pages = starts[same_page], pages[same_page]
+        boxes = []
+        for k, term in enumerate(terms):
+            ids = self.tokens[starts + k]
+            box = self.boxes[starts + k].copy()
+            # the matching part of a word is estimated from the character positions
+            first = firsts[ids] if k == 0 else numpy.zeros(len(ids), dtype=numpy.int32)
+            width = (box[:, 2] - box[:, 0]) / numpy.maximum(self.word_lengths[ids], 1)
+            box[:, 0] += first * width
+            box[:, 2] = box[:, 0] + len(term) * width
+            boxes.append(box)
+        # boxes of a hit stay together, hits keep their order in the document
+        boxes = numpy.stack(boxes, axis=1).reshape(-1, 4)
+        pages = numpy.repeat(pages, len(terms))
+        page_nos, page_firsts = numpy.unique(pages, return_index=True)
+        return dict(zip(page_nos.tolist(), numpy.split(boxes, page_firsts[1:])))
+
+
+class SearchIndexer(QtCore.QObject):
+    """ Builds the search index of a document in the background, or reads it from the disk
+        cache of the document. Building stops when a newer document is requested """
+    indexReady = QtCore.pyqtSignal(int, object)  # generation, SearchIndex
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        # set from the main thread, a running build compares its own generation with it
+        self.generation = 0
+
+    def build(self, generation, filename, doc_hash):
+        if generation != self.generation:
+            return
+        try:
+            path = os.path.join(document_cache_dir(doc_hash, "search"), INDEX_FILE)
+            index = SearchIndex.load(path) if os.path.exists(path) else None
+            if index is None:
+                doc = pymupdf.open(filename)
+                pages_words = []
+                for page in doc:
+                    if generation != self.generation:
+                        doc.close()
+                        return
+                    pages_words.append(page.get_text("words"))
+                doc.close()
+                index = SearchIndex.from_words(pages_words)
+                index.save(path)
+        except Exception as e:
+            # the file may be rewritten meanwhile, the next reload builds the index again
+            print(f"Can not index {filename}: {e}")
+            return
+        if generation == self.generation:
+            self.indexReady.emit(generation, index)
+
+
+
+class Searcher(QtCore.QObject):
+    """ Finds every hit of a text, with the index when it is ready, otherwise by scanning pages.
+        Pages are searched from the current page to the end and then from the beginning, hits are
+        sent in batches while the search goes on. A search stops when a newer search is requested """
+    hitsFound = QtCore.pyqtSignal(int, list)  # generation, list of (page_no, boxes, hit count)
+    searchFinished = QtCore.pyqtSignal(int, int)  # generation, total hit count
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.doc = None
+        # both are set from the main thread
+        self.index: Optional[SearchIndex] = None
+        self.generation = 0
+
+    def load_document(self, filename, password='', doc_hash=''):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+        try:
+            self.doc = pymupdf.open(filename)
+        except Exception as e:
+            # the file may be rewritten meanwhile, the reload after the next change opens it again
+            print(f"Searcher can not open {filename}: {e}")
+
+    def search(self, generation, text, first_page):
+        if generation != self.generation or self.doc is None:
+            return
+        pages = list(range(first_page, len(self.doc) + 1)) + list(range(1, first_page))
+        index = self.index
+        if index is None:
+            # hits of a page are sent as soon as the page is scanned
+            total = 0
+            for page_no in pages:
+                if generation != self.generation:
+                    return
+                rects = self.doc[page_no - 1].search_for(text)
+                if rects:
+                    boxes = numpy.array([tuple(rect) for rect in rects], dtype=numpy.float32)
+                    total += len(rects)
+                    self.hitsFound.emit(generation, [(page_no, boxes, len(rects))])
+            self.searchFinished.emit(generation, total)
+            return
+        found = index.search(text)
+        terms = len(text.split())
+        hits = [(page_no, found[page_no], len(found[page_no]) // terms) for page_no in pages if page_no in found]
+        for first in range(0, len(hits), SEARCH_BATCH):
+            if generation != self.generation:
+                return
+            self.hitsFound.emit(generation, hits[first:first + SEARCH_BATCH])
+        self.searchFinished.emit(generation, sum(hit[2] for hit in hits))
+
+
+class SearchResultsModel(QtCore.QAbstractListModel):
+    """ One row per page with hits. Rows are kept in page order while hits stream in """
+
+    def __init__(self, parent=None):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.pages: List[int] = []
+        self.hits: Dict[int, numpy.ndarray] = {}  # page_no: boxes of the hits
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.pages)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        page_no = self.pages[index.row()]
+        count = self.counts[page_no]
+        return f"Page {page_no}    {count} {'match' if count == 1 else 'matches'}"
+
+    def add_hits(self, hits):
+        for page_no, boxes, count in hits:
+            if page_no in self.hits:
+                continue
+            row = bisect.bisect_left(self.pages, page_no)
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+            self.pages.insert(row, page_no)
+            self.hits[page_no] = boxes
+            self.counts[page_no] = count
+            self.total += count
+            self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.pages = []
+        self.hits = {}
+        self.counts = {}
+        self.total = 0
+        self.endResetModel()
+
+    def row_of(self, page_no) -> int:
+        return self.pages.index(page_no) if page_no in self.hits else -1
+
+    def page_after(self, page_no) -> Optional[int]:
+        """ First page with hits from page_no on """
+        row = bisect.bisect_left(self.pages, page_no)
+        return self.pages[row] if row < len(self.pages) else None
+
+    def page_before(self, page_no) -> Optional[int]:
+        """ Last page with hits up to page_no """
+        row = bisect.bisect_right(self.pages, page_no) - 1
+        return self.pages[row] if row >= 0 else None
@@ -0,0 +1,220 @@
+import bisect
+import math
+import re
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+import numpy
+import pymupdf
+
+WORD = namedtuple("WORD", ["x0", "y0", "x1", "y1", "word", "block_no", "line_no", "word_no"])
+LINE = namedtuple("LINE", ["block_no", "line_no", "first_word", "last_word"])  # word indexes, last is exclusive
+# side of a spatial index cell in points, about two lines of body text
+GRID_CELL_SIZE = 24.0
+# a point farther than this from every word, e.g. in a page margin, has no nearest word
+NEAREST_MAX_DISTANCE = 3 * GRID_CELL_SIZE
+# end of a sentence, closing quotes and brackets belong to the sentence
+SENTENCE_END = re.compile(r"[.!?…][\"”’')\]]*\s+")
+
+
+class WordGrid():
+    """ Uniform grid over word boxes in page coordinates. Each cell lists the words overlapping it,
+        a point query only checks the few words of one cell """
+
+    def __init__(self, boxes: numpy.ndarray, cell_size: float = GRID_CELL_SIZE):
+        self.boxes = boxes
+        self.cell_size = cell_size
+        cells: Dict[Tuple[int, int], List[int]] = {}
+        for count, (x0, y0, x1, y1) in enumerate(boxes.tolist()):
+            for cx in range(int(x0 // cell_size), int(x1 // cell_size) + 1):
+                for cy in range(int(y0 // cell_size), int(y1 // cell_size) + 1):
+                    cells.setdefault((cx, cy), []).append(count)
+        self.cells: Dict[Tuple[int, int], numpy.ndarray] = \
+            {cell: numpy.array(counts, dtype=numpy.int32) for cell, counts in cells.items()}
+
+    def word_at(self, x: float, y: float) -> int:
+        """ Index of the first word containing the point, -1 if there is none """
+        counts = self.cells.get((int(x // self.cell_size), int(y // self.cell_size)))
+        if counts is None:
+            return -1
+        boxes = self.boxes[counts]
+        hits = numpy.flatnonzero((boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3]))
+        return int(counts[hits[0]]) if len(hits) else -1
+
+    def nearest(self, x: float, y: float, max_distance: float = NEAREST_MAX_DISTANCE, max_rings: int = 3) -> int:
+        """ Index of the word closest to the point, -1 if no word is within max_distance. Cells are searched
+            in rings around the point until the next ring is farther than the closest word found, all words
+            are checked only if there is no word in max_rings rings and max_distance reaches beyond them """
+        cx, cy = int(x // self.cell_size), int(y // self.cell_size)
+        # words not seen yet are at least this far plus a cell per ring from the point
+        edge = min(x - cx * self.cell_size, (cx + 1) * self.cell_size - x,
+                   y - cy * self.cell_size, (cy + 1) * self.cell_size - y)
+        best, best_distance = -1, math.inf
+        ring = 0
+        while ring <= max_rings or best >= 0:
+            if ring > 0:
+                inner = edge + (ring - 1) * self.cell_size
+                if inner * inner > best_distance or inner > max_distance:
+                    break
+            candidates = [self.cells[(i, j)] for i in range(cx - ring, cx + ring + 1)
+                          for j in range(cy - ring, cy + ring + 1)
+                          if max(abs(i - cx), abs(j - cy)) == ring and (i, j) in self.cells]
+            if candidates:
+                counts = numpy.concatenate(candidates)
+                distances = self.distance(self.boxes[counts], x, y)
+                closest = numpy.argmin(distances)
+                if distances[closest] < best_distance:
+                    best, best_distance = int(counts[closest]), float(distances[closest])
+            ring += 1
+        if best < 0 and ring > max_rings and len(self.boxes):
+            distances = self.distance(self.boxes, x, y)
+            best = int(numpy.argmin(distances))
+            best_distance = float(distances[best])
+        return best if best_distance <= max_distance * max_distance else -1
+
+    @staticmethod
+    def distance(boxes: numpy.ndarray, x: float, y: float) -> numpy.ndarray:
+        """ Squared distances from the point to each box, 0 inside a box """
+        dx = numpy.maximum(numpy.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+        dy = numpy.maximum(numpy.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+        return dx * dx + dy * dy
+
+
+class PageText():
+    """ Text of a page, extracted once from a single MuPDF text page and shared by hover,
+        selection, reflow and translation. Coordinates are in points, so zoom changes keep it valid.
+        text holds the words in extraction order, a space between words, a new line between
+        lines and an empty line between blocks.
+        Words are packed into arrays, a page of a few thousand words takes tens of kilobytes:
+        boxes has a float32 row x0 y0 x1 y1 per word, numbers an int32 row block_no line_no word_no
+        and spans the start and end of the word in text. WORD records are built only on request """
+
+    def __init__(self, page: pymupdf.Page):
+        text_page = page.get_textpage()
+        words = text_page.extractWORDS()
+        self.boxes = numpy.array([word[:4] for word in words], dtype=numpy.float32).reshape(-1, 4)
+        self.numbers = numpy.array([word[5:8] for word in words], dtype=numpy.int32).reshape(-1, 3)
+        self.blocks: Dict[int, pymupdf.Rect] = {}
+        for b in text_page.extractBLOCKS():
+            self.blocks[b[5]] = pymupdf.Rect(x0=b[0], y0=b[1], x1=b[2], y1=b[3])
+        self.lines: List[LINE] = []
+        spans = []
+        parts = []
+        offset = 0
+        for count, word in enumerate(words):
+            block_no, line_no = word[5], word[6]
+            if not self.lines or (block_no, line_no) != self.lines[-1][:2]:
+                if self.lines:
+                    separator = "\n" if block_no == self.lines[-1].block_no else "\n\n"
+                    parts.append(separator)
+                    offset += len(separator)
+                    self.lines[-1] = self.lines[-1]._replace(last_word=count)
+                self.lines.append(LINE(block_no, line_no, count, count))
+            else:
+                parts.append(" ")
+                offset += 1
+            spans.append((offset, offset + len(word[4])))
+            parts.append(word[4])
+            offset += len(word[4])
+        if self.lines:
+            self.lines[-1] = self.lines[-1]._replace(last_word=len(words))
+        self.text = "".join(parts)
+        self.spans = numpy.array(spans, dtype=numpy.int32).reshape(-1, 2)
+        self.grid = None  # built on the first point query, many pages are never hovered
+        # reading order of words and position of each word in it, set by x_y_cut.reading_order
+        self.order: numpy.ndarray = None
+        self.rank: numpy.ndarray = None
+        self.sentences: List[Tuple[int, int]] = None  # built on first use
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def word(self, count: int) -> WORD:
+        start, end = self.spans[count].tolist()
+        return WORD(*self.boxes[count].tolist(), self.text[start:end], *self.numbers[count].tolist())
+
+    def word_string(self, count: int) -> str:
+        start, end = self.spans[count].tolist()
+        return self.text[start:end]
+
+    def block_nos(self) -> List[int]:
+        return self.numbers[:, 0].tolist()
+
+    def word_at(self, x: float, y: float) -> int:
+        """ Index of the word at a point in page coordinates, -1 if there is none """
+        return self.get_grid().word_at(x, y)
+
+    def nearest_word(self, x: float, y: float, max_distance: float = NEAREST_MAX_DISTANCE) -> int:
+        return self.get_grid().nearest(x, y, max_distance)
+
+    def get_grid(self) -> WordGrid:
+        if self.grid is None:
+            self.grid = WordGrid(self.boxes)
+        return self.grid
+
+    def word_at_numpy(self, x: float, y: float) -> int:
+        """ Same as word_at, tests all word boxes at once. Kept to compare with the grid """
+        boxes = self.boxes
+        hits = numpy.flatnonzero((boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3]))
+        return int(hits[0]) if len(hits) else -1
+
+    def word_text(self, first_word: int, last_word: int) -> str:
+        """ Text from the first word to the last word, both included, with the line breaks between them """
+        if not len(self) or last_word < first_word:
+            return ""
+        return self.text[self.spans[first_word, 0]:self.spans[last_word, 1]]
+
+    def words_text(self, words: List[WORD]) -> str:
+        """ Joins a selection of words, words of the same line are separated by spaces """
+        text = ""
+        previous = None
+        for word in words:
+            if previous is not None:
+                text += " " if (word.block_no, word.line_no) == (previous.block_no, previous.line_no) else "\n"
+            text += word.word
+            previous = word
+        return text
+
+    def block_texts(self) -> List[str]:
+        """ Text of each block in one line """
+        return list(self.text_blocks().values())
+
+    def text_blocks(self) -> Dict[int, str]:
+        """ Text of each block in one line by block number, in extraction order """
+        blocks = {}
+        for line in self.lines:
+            blocks.setdefault(line.block_no, []).append(self.word_text(line.first_word, line.last_word - 1))
+        return {block_no: " ".join(lines) for block_no, lines in blocks.items()}
+
+    def get_sentences(self) -> List[Tuple[int, int]]:
+        """ Start and end of each sentence in text. A sentence does not continue in the next block """
+        if self.sentences is None:
+            self.sentences = []
+            block_ranges = {}
+            for line in self.lines:
+                start, end = block_ranges.get(line.block_no, (self.spans[line.first_word, 0], 0))
+                block_ranges[line.block_no] = (start, self.spans[line.last_word - 1, 1])
+            for start, end in block_ranges.values():
+                position = int(start)
+                for match in SENTENCE_END.finditer(self.text, position, int(end)):
+                    self.sentences.append((position, match.start() + len(match.group().rstrip())))
+                    position = match.end()
+                if position < end:
+                    self.sentences.append((position, int(end)))
+        return self.sentences
+
+    def sentence_texts(self) -> List[Tuple[int, str]]:
+        """ Start and text of each sentence, lines of a sentence are joined by spaces """
+        return [(start, self.text[start:end].replace("\n", " ")) for start, end in self.get_sentences()]
+
+    def sentences_of(self, counts: List[int]) -> List[Tuple[int, str]]:
+        """ Sentences holding the given words, in the order of the words """
+        sentences = self.get_sentences()
+        starts = [start for start, _ in sentences]
+        found = {}
+        for count in counts:
+            row = bisect.bisect_right(starts, int(self.spans[count, 0])) - 1
+            if row >= 0 and row not in found:
+                start, end = sentences[row]
+                found[row] = (start, self.text[start:end].replace("\n", " "))
+        return list(found.values())
@@ -0,0 +1,191 @@
+import os
+from collections import OrderedDict
+from typing import List
+
+import pymupdf
+from PyQt5 import QtCore
+from PyQt5.QtGui import QImage, QPixmap, QColor
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+
+from doc_cache import document_cache_dir
+from render_cache import qimage_format
+
+THUMBNAIL_WIDTH = 96
+THUMBNAIL_HEIGHT = 136
+# thumbnails kept in memory, the rest is read again from the disk cache
+THUMBNAIL_MEMORY_LIMIT = 400
+
+
+class ThumbnailRenderer(QtCore.QObject):
+    """ Renders page thumbnails at a very low dpi and stores them in the disk cache of the document.
+        A batch stops as soon as a newer batch is requested """
+    thumbnailReady = QtCore.pyqtSignal(int, QImage)
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.doc = None
+        self.cache_dir = None
+        # set from the main thread, a running batch compares its own generation with it
+        self.generation = 0
+
+    def load_document(self, filename, password='', doc_hash=''):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+        try:
+            self.doc = pymupdf.open(filename)
+        except Exception as e:
+            # the file may be rewritten meanwhile, the reload after the next change opens it again
+            print(f"Thumbnails can not open {filename}: {e}")
+            return
+        self.cache_dir = document_cache_dir(doc_hash, "thumbnails")
+
+    def render_batch(self, generation, pages: List[int], emit_count):
+        """ Thumbnails of the first emit_count pages are sent to the view,
+            the remaining pages are only rendered into the disk cache """
+        for count, page_no in enumerate(pages):
+            if generation != self.generation or self.doc is None:
+                return
+            path = os.path.join(self.cache_dir, f"{page_no}.png")
+            if count >= emit_count:
+                if not os.path.exists(path):
+                    self.render(page_no).save(path, "PNG")
+                continue
+            image = QImage(path)
+            if image.isNull():
+                image = self.render(page_no)
+                image.save(path, "PNG")
+            self.thumbnailReady.emit(page_no, image)
+
+    def render(self, page_no) -> QImage:
+        page = self.doc[page_no - 1]
+        zoom = min(THUMBNAIL_WIDTH / page.rect.width, THUMBNAIL_HEIGHT / page.rect.height)
+        img = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False, annots=False)
+        return QImage(img.samples, img.width, img.height, img.stride, qimage_format(img.n)).copy()
+
+
+class ThumbnailModel(QtCore.QAbstractListModel):
+    """ One row per page. Only rows that have been rendered hold an image, the others
+        show a blank placeholder with the same size so the view can use uniform item sizes """
+
+    def __init__(self, pages_count, parent=None):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.pages_count = pages_count
+        self.thumbnails = OrderedDict()  # page_no: QPixmap
+        self.placeholder = QPixmap(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+        self.placeholder.fill(QColor(230, 230, 230))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.pages_count
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        page_no = index.row() + 1
+        if role == QtCore.Qt.DisplayRole:
+            return str(page_no)
+        if role == QtCore.Qt.DecorationRole:
+            return self.thumbnails.get(page_no, self.placeholder)
+        if role == QtCore.Qt.TextAlignmentRole:
+            return QtCore.Qt.AlignCenter
+        return None
+
+    def has_thumbnail(self, page_no):
+        return page_no in self.thumbnails
+
+    def set_pages_count(self, pages_count):
+        if pages_count > self.pages_count:
+            self.beginInsertRows(QtCore.QModelIndex(), self.pages_count, pages_count - 1)
+            self.pages_count = pages_count
+            self.endInsertRows()
+        elif pages_count < self.pages_count:
+            self.beginRemoveRows(QtCore.QModelIndex(), pages_count, self.pages_count - 1)
+            for page_no in range(pages_count + 1, self.pages_count + 1):
+                self.thumbnails.pop(page_no, None)
+            self.pages_count = pages_count
+            self.endRemoveRows()
+
+    def remove_thumbnail(self, page_no):
+        if self.thumbnails.pop(page_no, None) is not None:
+            index = self.index(page_no - 1)
+            self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def set_thumbnail(self, page_no, image):
+        self.thumbnails[page_no] = QPixmap.fromImage(image)
+        self.thumbnails.move_to_end(page_no)
+        while len(self.thumbnails) > THUMBNAIL_MEMORY_LIMIT:
+            old_page_no, _ = self.thumbnails.popitem(last=False)
+            old_index = self.index(old_page_no - 1)
+            self.dataChanged.emit(old_index, old_index, [QtCore.Qt.DecorationRole])
+        index = self.index(page_no - 1)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+
+class ThumbnailView(QListView):
+    """ Requests thumbnails of the visible rows first, then of the rows around them """
+    thumbnailsRequested = QtCore.pyqtSignal(int, list, int)
+    pageClicked = QtCore.pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        QListView.__init__(self, parent)
+        self.setUniformItemSizes(True)
+        self.setIconSize(QtCore.QSize(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT))
+        self.setViewMode(QListView.IconMode)
+        self.setFlow(QListView.TopToBottom)
+        self.setWrapping(False)
+        self.setMovement(QListView.Static)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        self.generation = 0
+        self.requestTimer = QtCore.QTimer(self)
+        self.requestTimer.setSingleShot(True)
+        self.requestTimer.timeout.connect(self.request_thumbnails)
+        self.verticalScrollBar().valueChanged.connect(lambda value: self.requestTimer.start(50))
+        self.clicked.connect(lambda index: self.pageClicked.emit(index.row() + 1))
+
+    def resizeEvent(self, ev):
+        QListView.resizeEvent(self, ev)
+        self.requestTimer.start(50)
+
+    def showEvent(self, ev):
+        QListView.showEvent(self, ev)
+        self.requestTimer.start(50)
+
+    def visible_rows(self):
+        first = self.indexAt(QtCore.QPoint(5, 5)).row()
+        last = self.indexAt(QtCore.QPoint(5, self.viewport().height() - 5)).row()
+        if first == -1:
+            first = 0
+        if last == -1:
+            last = self.model().rowCount() - 1
+        return first, last
+
+    def request_thumbnails(self):
+        model: ThumbnailModel = self.model()
+        if model is None or not self.isVisible():
+            return
+        first, last = self.visible_rows()
+        # visible pages, then outwards from the viewport until every page is cached on disk
+        order = list(range(first + 1, last + 2))
+        below, above = last + 2, first
+        while below <= model.pages_count or above >= 1:
+            if below <= model.pages_count:
+                order.append(below)
+                below += 1
+            if above >= 1:
+                order.append(above)
+                above -= 1
+        order = [page_no for page_no in order if not model.has_thumbnail(page_no)]
+        if not order:
+            return
+        # pages near the viewport are shown, the others only fill the disk cache
+        emit_count = (last - first + 1) + THUMBNAIL_MEMORY_LIMIT // 4
+        self.generation += 1
+        self.thumbnailsRequested.emit(self.generation, order, emit_count)
+
+    def set_current_page(self, page_no):
+        if self.model() is None or not self.isVisible():
+            return
+        index = self.model().index(page_no - 1)
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
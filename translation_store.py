@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from doc_cache import CACHE_ROOT, document_cache_dir
+
+STORE_FILE = "translations.sqlite"
+BLOCK = 0  # a text block of a page, start is its offset in the block texts of the page joined by new lines
+SELECTION = 1  # a selection, start is the offset of its first word in the page text
+SENTENCE = 2  # a sentence of a block, start is its offset in the page text
+
+
+def source_hash(text: str) -> int:
+    """ Stored next to the offset, a row whose source text changed is not used """
+    return zlib.crc32(text.encode())
+
+
+def block_offsets(blocks: List[str]) -> List[int]:
+    offsets = []
+    offset = 0
+    for block in blocks:
+        offsets.append(offset)
+        offset += len(block) + 1
+    return offsets
+
+
+class TranslationStore():
+    """ Translations of a document kept in an sqlite file in the cache directory of the document,
+        so the name of the file is the content hash of the document. Rows of blocks and selections
+        are keyed by model, page and offset, word translations only depend on the model.
+        It is used from the translator thread and from the main thread """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # it is a cache, losing the last writes on a crash is acceptable
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS texts (model TEXT, kind INTEGER, page INTEGER, start INTEGER, "
+                        "hash INTEGER, translation TEXT, PRIMARY KEY (model, kind, page, start)) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS words (model TEXT, word TEXT, translation TEXT, "
+                        "PRIMARY KEY (model, word)) WITHOUT ROWID")
+        self.db.commit()
+
+    @classmethod
+    def open_document(cls, doc_hash: str) -> "TranslationStore":
+        return cls(os.path.join(document_cache_dir(doc_hash), STORE_FILE))
+
+    @classmethod
+    def copy_document(cls, old_hash: str, doc_hash: str):
+        """ A rewritten file gets a new hash, rows of its previous version are copied to the new store.
+            Rows of text that changed are kept but not used, their source hash does not match """
+        old_path = os.path.join(CACHE_ROOT, old_hash, STORE_FILE)
+        if not os.path.exists(old_path):
+            return
+        store = cls.open_document(doc_hash)
+        with store.lock:
+            store.db.execute("ATTACH DATABASE ? AS old", (old_path,))
+            store.db.execute("INSERT OR IGNORE INTO texts SELECT * FROM old.texts")
+            store.db.execute("INSERT OR IGNORE INTO words SELECT * FROM old.words")
+            store.db.commit()
+            store.db.execute("DETACH DATABASE old")
+        store.db.close()
+
+    def get_texts(self, model: str, kind: int, page_no: int, items: List[Tuple[int, str]]) -> Dict[int, str]:
+        """ items are (start, source text), returns the stored translations by start """
+        if not items:
+            return {}
+        hashes = {start: source_hash(text) for start, text in items}
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT start, hash, translation FROM texts WHERE model = ? AND kind = ? AND page = ? "
+                "AND start BETWEEN ? AND ?", (model, kind, page_no, min(hashes), max(hashes))).fetchall()
+        return {start: translation for start, text_hash, translation in rows if hashes.get(start) == text_hash}
+
+    def put_texts(self, model: str, kind: int, page_no: int, items: List[Tuple[int, str, str]]):
+        """ items are (start, source text, translation) """
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?, ?, ?)",
+                                [(model, kind, page_no, start, source_hash(text), translation)
+                                 for start, text, translation in items])
+            self.db.commit()
+
+    def get_word(self, model: str, word: str) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute("SELECT translation FROM words WHERE model = ? AND word = ?",
+                                  (model, word)).fetchone()
+        return row[0] if row else None
+
+    def put_word(self, model: str, word: str, translation: str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO words VALUES (?, ?, ?)", (model, word, translation))
+            self.db.commit()
+
@@ -1,14 +1,18 @@
-from typing import Optional
+from typing import List, Optional
 
 from quickmt.quickmt import Translator
 import spacy
 import json
 import asyncio
+import os
 import aiofiles
 import string
 
+MODEL_PATH = "./quickmt-en-tr/"
+# part of the keys of cached translations, translations of another model are not reused
+MODEL_NAME = os.path.basename(os.path.normpath(MODEL_PATH))
 # Auto-detects GPU, set to "cpu" to force CPU inference
-t = Translator("./quickmt-en-tr/", device="auto")
+t = Translator(MODEL_PATH, device="auto")
 nlp = spacy.load("en_core_web_trf")
 dictionary = {}
 
@@ -48,6 +52,14 @@ def translate(input_text: str) -> str:
     return " ".join(result)
 
 
+def translate_batch(texts: List[str]) -> List[str]:
+    """ Translates texts in one call, the model splits them into sentences and batches them """
+    texts = [text.strip().replace("\n", " ") for text in texts]
+    if not texts:
+        return []
+    return t(texts, beam_size=5)
+
+
 def clear_word(word: str):
     word.lower()
     if word[-1] in string.punctuation:
@@ -1,211 +1,105 @@
-from typing import List, Dict, Optional, Union, Tuple
-from asyncio import sleep, wrap_future
-from collections import namedtuple
-from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import bisect
+import math
 
-import pymupdf
+import numpy
 from PyQt5 import QtCore
-from PyQt5.QtGui import QPixmap
 
-
-WORD = namedtuple("WORD", ["x0", "y0", "x1", "y1", "word", "block_no", "line_no", "word_no"])
-
-@dataclass
-class BLOG_INFO():
-    block_point: pymupdf.Rect
-    block_count: int
+from text_model import PageText, WORD
+
+BOX = Tuple[float, float, float, float]
+# a shorter drag is a click, it selects nothing
+MIN_DRAG_PIXELS = 4
+
+
+def widest_gap(boxes: List[Tuple[BOX, int]], lo: int, hi: int) -> Optional[Tuple[float, float]]:
+    """ Widest empty band between the projections of boxes on one axis, as (width, position).
+        lo and hi are the indexes of the box edges on that axis """
+    return max(gaps(boxes, lo, hi), default=None)
+
+
+def gaps(boxes: List[Tuple[BOX, int]], lo: int, hi: int) -> List[Tuple[float, float]]:
+    intervals = sorted((box[lo], box[hi]) for box, _ in boxes)
+    found = []
+    end = intervals[0][1]
+    for start, stop in intervals[1:]:
+        if start > end:
+            found.append((start - end, start))
+        end = max(end, stop)
+    return found
+
+
+def xy_cut(boxes: List[Tuple[BOX, int]]) -> List[int]:
+    """ Recursive XY-cut. A region is split into columns at its widest vertical empty band. A region
+        without columns is split into bands at every horizontal empty band, but consecutive bands that
+        have columns are kept together, otherwise paragraphs of different columns would interleave.
+        Returns the keys of the boxes in reading order """
+    if len(boxes) <= 1:
+        return [key for _, key in boxes]
+    x_gap = widest_gap(boxes, 0, 2)
+    if x_gap is not None:
+        return xy_cut([item for item in boxes if item[0][0] < x_gap[1]]) + \
+               xy_cut([item for item in boxes if item[0][0] >= x_gap[1]])
+    positions = sorted(position for _, position in gaps(boxes, 1, 3))
+    bands = [[] for _ in range(len(positions) + 1)]
+    for item in boxes:
+        bands[bisect.bisect_right(positions, item[0][1])].append(item)
+    if len(bands) == 1:
+        return [key for _, key in sorted(boxes, key=lambda item: (item[0][1], item[0][0]))]
+    merged = []
+    for band in bands:
+        if merged and has_columns(band) and has_columns(merged[-1]):
+            merged[-1] = merged[-1] + band
+        else:
+            merged.append(band)
+    if len(merged) == 1:  # columns of the bands do not line up, they are read band by band
+        merged = bands
+    return [key for band in merged for key in xy_cut(band)]
+
+
+def has_columns(boxes: List[Tuple[BOX, int]]) -> bool:
+    return len(boxes) > 1 and widest_gap(boxes, 0, 2) is not None
+
+
+def reading_order(page_text: PageText) -> numpy.ndarray:
+    """ Orders text blocks of the page with XY-cut, words of a block keep their extraction order.
+        It runs once per page, the result is kept in page_text """
+    if page_text.order is None:
+        block_words = {}
+        for count, block_no in enumerate(page_text.block_nos()):
+            block_words.setdefault(block_no, []).append(count)
+        boxes = [(tuple(page_text.blocks[block_no]), block_no) for block_no in block_words
+                 if block_no in page_text.blocks]
+        ordered_blocks = xy_cut(boxes)
+        ordered_blocks += [block_no for block_no in block_words if block_no not in page_text.blocks]
+        page_text.order = numpy.array([count for block_no in ordered_blocks for count in block_words[block_no]],
+                                      dtype=numpy.int32)
+        page_text.rank = numpy.empty(len(page_text), dtype=numpy.int32)
+        page_text.rank[page_text.order] = numpy.arange(len(page_text), dtype=numpy.int32)
+    return page_text.order
 
 
 class XYcut():
-    def __init__(self, doc:pymupdf.Document, page_no: int, first_pos: QtCore.QPoint, last_pos: QtCore.QPoint, zoom: float, img: QPixmap):
-        self.doc = doc
-        self.page_no = page_no
+    def __init__(self, page_text: PageText, first_pos: QtCore.QPoint, last_pos: QtCore.QPoint, zoom: float):
+        self.page_text = page_text
         self.first_pos = first_pos
         self.last_pos = last_pos
         self.zoom = zoom
-        self.img = img
-        
-    def get_text_in_rect(self) -> List[WORD]:
-        if self.first_pos.x() < self.last_pos.x():
-            x0 = self.first_pos.x() / self.zoom
-            x1 = self.last_pos.x() / self.zoom
-        else:
-            x0 = self.last_pos.x() / self.zoom
-            x1 = self.first_pos.x() / self.zoom
-
-        if self.first_pos.y() < self.last_pos.y():
-            y0 = self.first_pos.y() / self.zoom
-            y1 = self.last_pos.y() / self.zoom
-        else:
-            y0 = self.last_pos.y() / self.zoom
-            y1 = self.first_pos.y() / self.zoom
-
-
-        selection_rect = pymupdf.Rect(x0=x0, y0=y0, x1=x1, y1=y1)
-        text_cordinat_list = []
-
-
-        if (self.first_pos.x() < self.last_pos.x() and self.first_pos.y() < self.last_pos.y()) or (
-                self.first_pos.x() > self.last_pos.x() and self.first_pos.y() > self.last_pos.y()):
-            text_cordinat_list = self.select_lr(selection_rect)
-        elif (self.first_pos.x() < self.last_pos.x() and self.first_pos.y() > self.last_pos.y()) or (
-                self.first_pos.x() > self.last_pos.x() and self.first_pos.y() < self.last_pos.y()):
-            text_cordinat_list = self.select_rl(selection_rect)
-        return text_cordinat_list
-
-
-    def get_blocks(self) -> Dict[int, pymupdf.Rect]:
-        block_list = self.doc[self.page_no - 1].get_textpage().extractBLOCKS()
-        block_dict = {}
-        for b in block_list:
-            block_dict[b[5]] = pymupdf.Rect(x0=b[0], y0=b[1], x1=b[2], y1=b[3])
-        return block_dict
-
-    def get_intersection_rect(self, rect1: pymupdf.Rect, rect2: pymupdf.Rect) -> Optional[pymupdf.Rect]:
-        x0 = max(rect1.x0, rect2.x0)
-        y0 = max(rect1.y0, rect2.y0)
-        x1 = min(rect1.x1, rect2.x1)
-        y1 = min(rect1.y1, rect2.y1)
-
-        if x0 < x1 and y0 < y1:
-            return pymupdf.Rect(x0=x0, y0=y0, x1=x1, y1=y1)
-        else:
-            # Eğer geçerli bir kesişim yoksa None döndürüyoruz
-            return None
-
-    def get_word_list(self) -> List[WORD]:
-        text_page = self.doc[self.page_no - 1].get_textpage()
-        word_list = text_page.extractWORDS()
-        return [WORD(x0=i[0], y0=i[1], x1=i[2], y1=i[3], word=i[4], block_no=i[5], line_no=i[6], word_no=i[7]) for i in word_list]
-
-    def detect_start_and_end_blocks(self, selection_rect: pymupdf.Rect) -> Tuple[Optional[BLOG_INFO], Optional[BLOG_INFO]]:
-        start_block: Optional[BLOG_INFO] = None
-        end_block: Optional[BLOG_INFO] = None
-
-        block_dict = self.get_blocks()
-        for block_count, block_point in block_dict.items():
-
-            res = self.get_intersection_rect(selection_rect, block_point)
-            if res is not None:
-                if start_block is None:
-                    start_block = BLOG_INFO(block_point, block_count)
-                    end_block = BLOG_INFO(block_point, block_count)
-                else:
-                    end_block = BLOG_INFO(block_point, block_count)
-        return start_block, end_block
-
 
+    def get_text_in_rect(self) -> List[WORD]:
+        """ Words from the word at the start of the drag to the word at its end in reading order """
+        return [self.page_text.word(count) for count in self.get_word_counts()]
 
-    
-    def select_lr(self, selection_rect: pymupdf.Rect) -> List[WORD]:
-        start_block, end_block = self.detect_start_and_end_blocks(selection_rect)
-        if start_block is None or end_block is None:
+    def get_word_counts(self) -> List[int]:
+        """ Indexes of the words of get_text_in_rect in the page text. Nothing is selected by a click
+            or by a drag that starts far from the text, a drag may end anywhere """
+        if not len(self.page_text) or (self.last_pos - self.first_pos).manhattanLength() < MIN_DRAG_PIXELS:
             return []
-        
-        word_list = self.get_word_list()
-
-        # Secim alanini daha anlasilir olmasi icin baslangic ve bitis olarak ayir
-        start_point = selection_rect.tl  # Top-Left (x0, y0)
-        end_point = selection_rect.br    # Bottom-Right (x1, y1)
-        
-        text_cordinat_list = []
-        for word in word_list:
-            
-            # --- 1. BLOK FİLTRESİ ---
-            # Kelime, secili blok araliginin disindaysa atla
-            if not (start_block.block_count <= word.block_no <= end_block.block_count):
-                continue
-            
-            # --- 2. Y EKSENİ FİLTRESİ (Genel Dikey Eleme) ---
-            # Bu, sizin hatanizi duzelten kisimdir.
-            if word.block_no == start_block.block_count or  word.block_no == end_block.block_count:
-            # Kelime, secim alaninin tamamen *uzerindeyse* atla
-            # (Kelimenin alti, secimin ustunden daha yukarida)
-                if word.block_no == start_block.block_count and word.y1 < start_point.y:
-                    continue
-
-                # Kelime, secim alaninin tamamen *altindaysa* atla
-                # (Kelimenin ustu, secimin altindan daha asagida)
-                if word.block_no == end_block.block_count and word.y0 > end_point.y:
-                    continue
-
-                # --- 3. X EKSENİ FİLTRESİ (Okuma Sirasi "Cut") ---
-                # Bu noktada kelimenin, secim alaninin dikey bandi icinde 
-                # (veya kesisim kumesinde) oldugunu biliyoruz.
-
-                # Kelime, *baslangic satirindaysa*...
-                # (Baslangic Y'si, kelimenin ust ve alt siniri arasindaysa)
-                if (word.y0 <= start_point.y <= word.y1):
-                    # ...ve kelime *tamamen* baslangic X'inin *solundaysa*, atla.
-                    if word.x1 < start_point.x:
-                        continue
-
-                # Kelime, *bitis satirindaysa*...
-                # (Bitis Y'si, kelimenin ust ve alt siniri arasindaysa)
-                if (word.y0 <= end_point.y <= word.y1):
-                     # ...ve kelime *tamamen* bitis X'inin *sagindaysa*, atla.
-                    if word.x0 > end_point.x:
-                        continue
-            
-            # Bu filtrelerden gecen kelime secilmistir.
-            text_cordinat_list.append(word)
-            
-        return text_cordinat_list
-    
-
-    
-
-    def select_rl(self, selection_rect: pymupdf.Rect) -> List[WORD]:
-        start_block, end_block = self.detect_start_and_end_blocks(selection_rect)
-        if start_block is None or end_block is None:
+        first_word = self.page_text.nearest_word(self.first_pos.x() / self.zoom, self.first_pos.y() / self.zoom)
+        last_word = self.page_text.nearest_word(self.last_pos.x() / self.zoom, self.last_pos.y() / self.zoom,
+                                                math.inf)
+        if first_word == -1:
             return []
-        
-        word_list = self.get_word_list()
-
-        # Secim alanini daha anlasilir olmasi icin baslangic ve bitis olarak ayir
-        start_point = pymupdf.Point(x=selection_rect.x1, y=selection_rect.y0)
-        end_point = pymupdf.Point(x=selection_rect.x0, y=selection_rect.y1)
-        
-        text_cordinat_list = []
-        for word in word_list:
-            
-            # --- 1. BLOK FİLTRESİ ---
-            # Kelime, secili blok araliginin disindaysa atla
-            if not (start_block.block_count <= word.block_no <= end_block.block_count):
-                continue
-            
-            # --- 2. Y EKSENİ FİLTRESİ (Genel Dikey Eleme) ---
-            # Bu, sizin hatanizi duzelten kisimdir.
-            if word.block_no == start_block.block_count or  word.block_no == end_block.block_count:
-            # Kelime, secim alaninin tamamen *uzerindeyse* atla
-            # (Kelimenin alti, secimin ustunden daha yukarida)
-                if word.block_no == start_block.block_count and word.y1 < start_point.y:
-                    continue
-
-                # Kelime, secim alaninin tamamen *altindaysa* atla
-                # (Kelimenin ustu, secimin altindan daha asagida)
-                if word.block_no == end_block.block_count and word.y0 > end_point.y:
-                    continue
-
-                # --- 3. X EKSENİ FİLTRESİ (Okuma Sirasi "Cut") ---
-                # Bu noktada kelimenin, secim alaninin dikey bandi icinde 
-                # (veya kesisim kumesinde) oldugunu biliyoruz.
-
-                # Kelime, *baslangic satirindaysa*...
-                # (Baslangic Y'si, kelimenin ust ve alt siniri arasindaysa)
-                if (word.y0 <= start_point.y <= word.y1):
-                    # ...ve kelime *tamamen* baslangic X'inin *solundaysa*, atla.
-                    if word.x1 < start_point.x:
-                        continue
-
-                # Kelime, *bitis satirindaysa*...
-                # (Bitis Y'si, kelimenin ust ve alt siniri arasindaysa)
-                if (word.y0 <= end_point.y <= word.y1):
-                     # ...ve kelime *tamamen* bitis X'inin *sagindaysa*, atla.
-                    if word.x0 > end_point.x:
-                        continue
-            
-            # Bu filtrelerden gecen kelime secilmistir.
-            text_cordinat_list.append(word)
-            
-        return text_cordinat_list
+        order = reading_order(self.page_text)
+        first, last = sorted((self.page_text.rank[first_word], self.page_text.rank[last_word]))
+        return order[first:last + 1].tolist()